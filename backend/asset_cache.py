@@ -0,0 +1,274 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+
+PROXY_ASSET_CACHE_DIR = os.getenv("PROXY_ASSET_CACHE_DIR", "./asset_cache")
+PROXY_ASSET_CACHE_MAX_BYTES = int(os.getenv("PROXY_ASSET_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PROXY_ASSET_MAX_BYTES = int(os.getenv("PROXY_ASSET_MAX_BYTES", str(20 * 1024 * 1024)))
+PROXY_ASSET_TTL = float(os.getenv("PROXY_ASSET_TTL", "86400"))
+PROXY_ASSET_BROWSER_MAX_AGE = int(os.getenv("PROXY_ASSET_BROWSER_MAX_AGE", "86400"))
+
+
+class AssetRecord:
+    """Index entry mapping an upstream URL to a content-addressed blob."""
+
+    def __init__(
+        self,
+        digest: str,
+        size: int,
+        content_type: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        stored_at: Optional[float] = None,
+    ):
+        self.digest = digest
+        self.size = size
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.stored_at < ttl
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_dict(self) -> dict:
+        return {
+            "digest": self.digest,
+            "size": self.size,
+            "content_type": self.content_type,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "stored_at": self.stored_at,
+        }
+
+
+class AssetWriter:
+    """Spools one asset to a temp file while hashing it."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex}.tmp")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.overflow = False
+        self._hash = hashlib.sha256()
+        self._file = open(self.path, "wb")
+
+    async def write(self, chunk: bytes):
+        # File writes block, so they run off the event loop
+        await asyncio.to_thread(self._write, chunk)
+
+    def _write(self, chunk: bytes):
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            # Too large to cache; keep streaming to the client but stop spooling
+            self.overflow = True
+            self.discard()
+            return
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class AssetCache:
+    """
+    Content-addressed asset store on local disk. Blobs are named by the
+    SHA-256 of their bytes, so identical assets referenced from different
+    projects, pages or URLs are stored once. A small JSON index maps each
+    normalized URL to its blob; least recently used blobs are evicted once
+    the store exceeds its byte budget.
+    """
+
+    def __init__(
+        self,
+        directory: str = PROXY_ASSET_CACHE_DIR,
+        max_bytes: int = PROXY_ASSET_CACHE_MAX_BYTES,
+        max_asset_bytes: int = PROXY_ASSET_MAX_BYTES,
+        ttl: float = PROXY_ASSET_TTL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_asset_bytes = max_asset_bytes
+        self.ttl = ttl
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.index_dir = os.path.join(directory, "index")
+        self.tmp_dir = os.path.join(directory, "tmp")
+        self._size: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def _ensure_dirs(self):
+        for path in (self.blob_dir, self.index_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _read_index(self, key: str) -> Optional[AssetRecord]:
+        try:
+            with open(self._index_path(key)) as f:
+                record = AssetRecord(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        # The blob may have been evicted since the index entry was written
+        if not os.path.exists(self.blob_path(record.digest)):
+            return None
+        return record
+
+    def _write_index(self, key: str, record: AssetRecord):
+        path = self._index_path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def _blob_files(self):
+        for root, _, names in os.walk(self.blob_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def _evict(self):
+        if self._size is None:
+            self._size = sum(stat.st_size for _, stat in self._blob_files())
+        if self._size <= self.max_bytes:
+            return
+        # Blobs are touched on every fresh lookup, so mtime order is LRU order
+        evicted = set()
+        for path, stat in sorted(self._blob_files(), key=lambda item: item[1].st_mtime):
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= stat.st_size
+            self.evictions += 1
+            evicted.add(os.path.basename(path))
+        if evicted:
+            self._prune_index(evicted)
+
+    def _prune_index(self, digests: set):
+        """Drop index entries that point at evicted blobs."""
+        for name in os.listdir(self.index_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.index_dir, name)
+            try:
+                with open(path) as f:
+                    digest = json.load(f).get("digest")
+                if digest in digests:
+                    os.remove(path)
+            except (OSError, ValueError, AttributeError):
+                continue
+
+    def _commit(self, key: str, writer: AssetWriter, record: AssetRecord):
+        writer.close()
+        blob = self.blob_path(record.digest)
+        if os.path.exists(blob):
+            # Same bytes already stored for another URL
+            writer.discard()
+            os.utime(blob)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(writer.path, blob)
+            if self._size is not None:
+                self._size += record.size
+        self._write_index(key, record)
+        self._evict()
+
+    def _lookup(self, key: str) -> Optional[AssetRecord]:
+        record = self._read_index(key)
+        if record is not None and record.is_fresh(self.ttl):
+            # About to be served: keep it at the young end of the eviction order
+            try:
+                os.utime(self.blob_path(record.digest))
+            except OSError:
+                pass
+        return record
+
+    def _touch(self, key: str, record: AssetRecord):
+        record.stored_at = time.time()
+        self._write_index(key, record)
+        try:
+            os.utime(self.blob_path(record.digest))
+        except OSError:
+            pass
+
+    async def lookup(self, key: str) -> Optional[AssetRecord]:
+        return await asyncio.to_thread(self._lookup, key)
+
+    def _writer(self) -> AssetWriter:
+        self._ensure_dirs()
+        return AssetWriter(self.tmp_dir, self.max_asset_bytes)
+
+    async def writer(self) -> AssetWriter:
+        return await asyncio.to_thread(self._writer)
+
+    async def commit(self, key: str, writer: AssetWriter, record: AssetRecord):
+        await asyncio.to_thread(self._commit, key, writer, record)
+
+    async def store(self, key: str, content: bytes, record: AssetRecord):
+        writer = await self.writer()
+        await writer.write(content)
+        if writer.overflow:
+            return
+        record.digest = writer.digest
+        record.size = writer.size
+        await self.commit(key, writer, record)
+
+    async def touch(self, key: str, record: AssetRecord):
+        """Mark an asset as fresh again after a 304 from upstream."""
+        self.revalidations += 1
+        await asyncio.to_thread(self._touch, key, record)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+asset_cache = AssetCache()
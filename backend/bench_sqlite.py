@@ -0,0 +1,104 @@
+"""
+Concurrent read/write benchmark for the SQLite settings in db_pragmas.py.
+
+Runs the same mix of comment inserts and per-page comment reads against a
+fresh database twice: once with SQLite defaults (rollback journal, NullPool)
+and once with the tuned pragmas and a pooled engine.
+
+    python bench_sqlite.py [--writers 8] [--readers 16] [--seconds 5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from db_models import Base
+from db_pragmas import DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT, apply_sqlite_pragmas
+
+
+PAGES = [str(uuid.uuid4()) for _ in range(20)]
+PROJECT_ID = str(uuid.uuid4())
+
+
+async def writer(engine, deadline, stats):
+    while time.monotonic() < deadline:
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    text("INSERT INTO comments (id, project_id, page_id, x, y, text, author, resolved, created_at) "
+                         "VALUES (:id, :project_id, :page_id, 1, 1, 'bench', 'bench', 0, :now)"),
+                    {"id": str(uuid.uuid4()), "project_id": PROJECT_ID,
+                     "page_id": PAGES[stats["writes"] % len(PAGES)], "now": datetime.utcnow()}
+                )
+            stats["writes"] += 1
+        except OperationalError:
+            stats["errors"] += 1
+
+
+async def reader(engine, deadline, stats):
+    while time.monotonic() < deadline:
+        try:
+            async with engine.connect() as conn:
+                result = await conn.execute(
+                    text("SELECT * FROM comments WHERE project_id = :project_id AND page_id = :page_id "
+                         "ORDER BY created_at DESC"),
+                    {"project_id": PROJECT_ID, "page_id": PAGES[stats["reads"] % len(PAGES)]}
+                )
+                result.fetchall()
+            stats["reads"] += 1
+        except OperationalError:
+            stats["errors"] += 1
+
+
+async def run(label, tuned, writers, readers, seconds):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    url = f"sqlite+aiosqlite:///{path}"
+    if tuned:
+        engine = create_async_engine(
+            url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=max(DB_MAX_OVERFLOW, writers + readers),
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+        apply_sqlite_pragmas(engine)
+    else:
+        # What the app ran with before tuning
+        engine = create_async_engine(url, poolclass=NullPool)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    stats = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(
+        *[writer(engine, deadline, stats) for _ in range(writers)],
+        *[reader(engine, deadline, stats) for _ in range(readers)],
+    )
+    await engine.dispose()
+
+    print(f"{label:<8} writes/s={stats['writes'] / seconds:8.1f}  "
+          f"reads/s={stats['reads'] / seconds:8.1f}  locked errors={stats['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(run("default", False, args.writers, args.readers, args.seconds))
+    asyncio.run(run("tuned", True, args.writers, args.readers, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Chunked cascade deletion of projects and pages.
+
+Deleting a project or page removes its row at once (so the API stops
+serving it) and hands the rows that hang off it to a background job. The
+job deletes them DELETION_BATCH_SIZE at a time, one short transaction per
+chunk, pausing between chunks so other writers get the SQLite write lock.
+
+Jobs live in the worker that started them; their status is reported by
+GET /jobs/{job_id}. A job cut short by a restart leaves orphans behind,
+which sweep_orphans (python maintenance.py sweep-orphans) reclaims.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+DELETION_BATCH_SIZE = int(os.getenv("DELETION_BATCH_SIZE", "500"))
+DELETION_PAUSE = float(os.getenv("DELETION_PAUSE", "0.01"))
+DELETION_JOBS_KEEP = int(os.getenv("DELETION_JOBS_KEEP", "1000"))
+
+# Rows that belong to a page, deleted before the page itself
+PAGE_CHILD_TABLES = ("comments", "lines", "strokes", "tombstones")
+
+CHUNK_DELETE_SQL = "DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {where} LIMIT :batch)"
+
+# Orphan tests, in the order the sweeper runs them: pages before the rows on them
+ORPHAN_CONDITIONS: List[Tuple[str, str]] = [
+    ("project_shares", "NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = project_shares.project_id)"),
+    ("pages", "NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = pages.project_id)"),
+] + [
+    (table, f"NOT EXISTS (SELECT 1 FROM pages pg WHERE pg.id = {table}.page_id)")
+    for table in PAGE_CHILD_TABLES
+]
+
+
+class DeletionJob:
+    def __init__(self, kind: str, target_id: str):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.target_id = target_id
+        self.status = "pending"
+        self.deleted: Dict[str, int] = {}
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "target_id": self.target_id,
+            "status": self.status,
+            "deleted": dict(self.deleted),
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+async def delete_in_chunks(engine: AsyncEngine, table: str, where: str, params: dict,
+                           batch_size: int = DELETION_BATCH_SIZE, pause: float = DELETION_PAUSE) -> int:
+    """Delete the rows of `table` matching `where`, one committed chunk at a time."""
+    statement = text(CHUNK_DELETE_SQL.format(table=table, where=where))
+    total = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(statement, dict(params, batch=batch_size))
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+        await asyncio.sleep(pause)
+
+
+async def sweep_orphans(engine: AsyncEngine, batch_size: int = DELETION_BATCH_SIZE,
+                        pause: float = DELETION_PAUSE) -> Dict[str, int]:
+    """
+    Delete shares, pages and annotations whose project or page no longer
+    exists. Each table is walked in primary key order, batch_size rows per
+    transaction, so a sweep reads every row once however many orphans it finds.
+    """
+    deleted = {}
+    for table, orphaned in ORPHAN_CONDITIONS:
+        next_ids = text(f"SELECT id FROM {table} WHERE id > :after ORDER BY id LIMIT :batch")
+        delete = text(f"DELETE FROM {table} WHERE id > :after AND id <= :last AND {orphaned}")
+        deleted[table] = 0
+        after = ""
+        while True:
+            async with engine.begin() as conn:
+                ids = (await conn.execute(next_ids, {"after": after, "batch": batch_size})).scalars().all()
+                if not ids:
+                    break
+                result = await conn.execute(delete, {"after": after, "last": ids[-1]})
+            deleted[table] += result.rowcount
+            after = ids[-1]
+            await asyncio.sleep(pause)
+    return deleted
+
+
+class DeletionJobs:
+    """Runs cascade deletions in the background and remembers how they went."""
+
+    def __init__(self, keep: int = DELETION_JOBS_KEEP):
+        self.keep = keep
+        self._jobs: "OrderedDict[str, DeletionJob]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, job_id: str) -> Optional[DeletionJob]:
+        return self._jobs.get(job_id)
+
+    def _start(self, engine: AsyncEngine, job: DeletionJob, steps: List[Tuple[str, str, dict]]) -> DeletionJob:
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.keep:
+            self._jobs.popitem(last=False)
+        task = asyncio.create_task(self._run(engine, job, steps))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, engine: AsyncEngine, job: DeletionJob, steps: List[Tuple[str, str, dict]]):
+        job.status = "running"
+        try:
+            for table, where, params in steps:
+                job.deleted[table] = job.deleted.get(table, 0) + await delete_in_chunks(engine, table, where, params)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as exc:
+            logger.exception("Deletion job %s (%s %s) failed", job.id, job.kind, job.target_id)
+            job.status = "failed"
+            job.error = str(exc)
+        finally:
+            job.finished_at = datetime.utcnow()
+
+    def delete_project_rows(self, engine: AsyncEngine, project_id: str) -> DeletionJob:
+        """Start deleting everything under an already-deleted project row."""
+        params = {"project_id": project_id}
+        steps = [(table, "project_id = :project_id", params) for table in PAGE_CHILD_TABLES]
+        steps.append(("pages", "project_id = :project_id", params))
+        return self._start(engine, DeletionJob("project", project_id), steps)
+
+    def delete_page_rows(self, engine: AsyncEngine, project_id: str, page_id: str) -> DeletionJob:
+        """Start deleting the annotations of an already-deleted page row."""
+        params = {"project_id": project_id, "page_id": page_id}
+        steps = [(table, "project_id = :project_id AND page_id = :page_id", params) for table in PAGE_CHILD_TABLES]
+        return self._start(engine, DeletionJob("page", page_id), steps)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+deletion_jobs = DeletionJobs()
@@ -1,34 +1,63 @@
 import os
-from sqlalchemy import create_engine, Column, String, Float, Boolean, Text, DateTime
-from sqlalchemy.ext.declarative import declarative_base
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-import uuid
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = "sqlite+aiosqlite:///./annotate.db"
+from db_pragmas import DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT, apply_sqlite_pragmas
 
-Base = declarative_base()
 
-class Comment(Base):
-    __tablename__ = "comments"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./annotate.db")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_ECHO = os.getenv("DB_ECHO", "0").lower() in ("1", "true", "yes")
 
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    project_id = Column(String(255), nullable=False, index=True)
-    x = Column(Float, nullable=False)
-    y = Column(Float, nullable=False)
-    text = Column(Text, nullable=False)
-    author = Column(String(255), nullable=False)
-    resolved = Column(Boolean, default=False, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=False
-)
+def async_database_url(url: str) -> str:
+    """Map plain sqlite:// and postgres:// URLs onto their async drivers."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+def create_db_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    url = async_database_url(url)
+    backend = make_url(url).get_backend_name()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if backend == "sqlite":
+        # aiosqlite defaults to NullPool, which reconnects (and re-runs the
+        # pragmas) for every session
+        engine = create_async_engine(
+            url,
+            echo=DB_ECHO,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+        apply_sqlite_pragmas(engine)
+        return engine
 
-def init_db():
-    if not os.path.exists("annotate.db"):
-        Base.metadata.create_all(bind=engine)
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+engine = create_db_engine()
+
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
+    class_=AsyncSession
+)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, Boolean, Text, DateTime, Integer
+from sqlalchemy import Column, String, Float, Boolean, Text, DateTime, Integer, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -6,6 +6,9 @@ Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ux_users_name", "name", unique=True),
+    )
 
     id = Column(String(36), primary_key=True)
     name = Column(String(255), nullable=False)
@@ -14,54 +17,84 @@ class User(Base):
 
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (
+        Index("ix_projects_user_updated", "user_id", "updated_at", "id"),
+        Index("ux_projects_user_title", "user_id", "title", unique=True),
+    )
 
     id = Column(String(36), primary_key=True)
-    user_id = Column(String(36), nullable=False, index=True)
+    user_id = Column(String(36), nullable=False)
     title = Column(String(255), nullable=True)
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
+    # Denormalized counters, kept in step by the write endpoints
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    open_comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    page_count = Column(Integer, nullable=False, default=0, server_default="0")
+    line_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Bumped whenever the project row or its page list changes; the ETag of get_project/get_pages
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
 
 class Page(Base):
     __tablename__ = "pages"
+    __table_args__ = (
+        Index("ix_pages_project_order", "project_id", "order"),
+    )
 
     id = Column(String(36), primary_key=True)
-    project_id = Column(String(36), nullable=False, index=True)
+    project_id = Column(String(36), nullable=False)
     url = Column(String(2048), nullable=False)
     title = Column(String(255), nullable=True)
     order = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False)
+    # Bumped by every comment/line change on the page; the sync cursor
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
 
 class ProjectShare(Base):
     __tablename__ = "project_shares"
+    __table_args__ = (
+        Index("ux_project_shares_project_user", "project_id", "shared_with_user_id", unique=True),
+        Index("ix_project_shares_user_created", "shared_with_user_id", "created_at", "project_id"),
+    )
 
     id = Column(String(36), primary_key=True)
-    project_id = Column(String(36), nullable=False, index=True)
-    shared_with_user_id = Column(String(36), nullable=False, index=True)
+    project_id = Column(String(36), nullable=False)
+    shared_with_user_id = Column(String(36), nullable=False)
     created_at = Column(DateTime, nullable=False)
 
 
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        Index("ix_comments_project_page_created", "project_id", "page_id", "created_at", "id"),
+        Index("ix_comments_project_page_revision", "project_id", "page_id", "revision"),
+    )
 
     id = Column(String(36), primary_key=True)
-    project_id = Column(String(255), nullable=False, index=True)
-    page_id = Column(String(36), nullable=False, index=True)
+    project_id = Column(String(255), nullable=False)
+    page_id = Column(String(36), nullable=False)
     x = Column(Float, nullable=False)
     y = Column(Float, nullable=False)
     text = Column(Text, nullable=False)
     author = Column(String(255), nullable=False)
     resolved = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=True)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
 
 class Line(Base):
     __tablename__ = "lines"
+    __table_args__ = (
+        Index("ix_lines_project_page_created", "project_id", "page_id", "created_at"),
+        Index("ix_lines_project_page_revision", "project_id", "page_id", "revision"),
+    )
 
     id = Column(String(36), primary_key=True)
-    project_id = Column(String(36), nullable=False, index=True)
-    page_id = Column(String(36), nullable=False, index=True)
+    project_id = Column(String(36), nullable=False)
+    page_id = Column(String(36), nullable=False)
     x1 = Column(Float, nullable=False)
     y1 = Column(Float, nullable=False)
     x2 = Column(Float, nullable=False)
@@ -69,3 +102,46 @@ class Line(Base):
     color = Column(String(20), nullable=False)
     author = Column(String(255), nullable=False)
     created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=True)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class Stroke(Base):
+    """A freehand polyline stored as one packed row (see polyline.py)."""
+    __tablename__ = "strokes"
+    __table_args__ = (
+        Index("ix_strokes_project_page_created", "project_id", "page_id", "created_at"),
+        Index("ix_strokes_project_page_revision", "project_id", "page_id", "revision"),
+    )
+
+    id = Column(String(36), primary_key=True)
+    project_id = Column(String(36), nullable=False)
+    page_id = Column(String(36), nullable=False)
+    points = Column(LargeBinary, nullable=False)
+    encoding = Column(String(16), nullable=False)
+    point_count = Column(Integer, nullable=False)
+    min_x = Column(Float, nullable=False)
+    min_y = Column(Float, nullable=False)
+    max_x = Column(Float, nullable=False)
+    max_y = Column(Float, nullable=False)
+    color = Column(String(20), nullable=False)
+    author = Column(String(255), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=True)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class Tombstone(Base):
+    """A deleted comment or line, kept so incremental sync can report it."""
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_project_page_revision", "project_id", "page_id", "revision"),
+    )
+
+    id = Column(String(36), primary_key=True)
+    project_id = Column(String(36), nullable=False)
+    page_id = Column(String(36), nullable=False)
+    kind = Column(String(20), nullable=False)
+    entity_id = Column(String(36), nullable=False)
+    revision = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
@@ -0,0 +1,187 @@
+"""
+Fast response encoding for list endpoints.
+
+Rows are turned straight into JSON by orjson, using the field list of the
+matching schema in schemas.py, instead of building one Pydantic model per
+row and letting FastAPI validate and serialize it again. The wire format
+is the same; each field gets the one coercion the model would have applied
+(SQLite integers to bool, timestamps to ISO strings).
+
+Clients can ask for a denser encoding with the Accept header:
+
+    application/json                          list of objects (default)
+    application/vnd.annotate.columnar+json    {"field": [values...], ...}
+    application/msgpack                       list of objects, MessagePack
+
+Streamed bodies can also be compressed on the fly (gzip, or brotli when
+the brotli package is installed) according to Accept-Encoding.
+"""
+import json
+import operator
+import os
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Iterable, List, Optional, Type, Union, get_args, get_origin
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.annotate.columnar+json"
+MSGPACK = "application/msgpack"
+
+# Appended to ETags so each encoding is cached separately
+ETAG_VARIANTS = {JSON: "", COLUMNAR_JSON: "-columnar", MSGPACK: "-msgpack"}
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _converter(annotation) -> Optional[Callable]:
+    if get_origin(annotation) is Union:
+        annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+    if annotation is bool:
+        return bool
+    if annotation is float:
+        return float
+    if annotation is str:
+        # Timestamps come back as strings from SQLite and datetimes from PostgreSQL
+        return _timestamp
+    return None
+
+
+class RowEncoder:
+    """Encodes rows (or objects with matching attributes) in a schema's wire format."""
+
+    def __init__(self, model: Type[BaseModel]):
+        self.fields = list(model.model_fields)
+        self.converters = [_converter(info.annotation) for info in model.model_fields.values()]
+        self._values = operator.attrgetter(*self.fields)
+
+    def _row(self, row) -> list:
+        return [
+            value if value is None or convert is None else convert(value)
+            for value, convert in zip(self._values(row), self.converters)
+        ]
+
+    def objects(self, rows: Iterable) -> List[dict]:
+        fields = self.fields
+        return [dict(zip(fields, self._row(row))) for row in rows]
+
+    def columns(self, rows: Iterable) -> dict:
+        values = [self._row(row) for row in rows]
+        return {field: [row[i] for row in values] for i, field in enumerate(self.fields)}
+
+
+_encoders = {}
+
+
+def encoder_for(model: Type[BaseModel]) -> RowEncoder:
+    if model not in _encoders:
+        _encoders[model] = RowEncoder(model)
+    return _encoders[model]
+
+
+def _quality(params: List[str]) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    The media type to answer with: the client's highest-q choice among those
+    this server can produce (JSON for wildcards), listed order breaking ties.
+    No Accept header means JSON; 406 if nothing acceptable can be produced.
+    """
+    if not accept or not accept.strip():
+        return JSON
+    available = [JSON, COLUMNAR_JSON] + ([MSGPACK] if msgpack is not None else [])
+    ranges = []
+    for media_range in accept.split(","):
+        media_type, *params = media_range.split(";")
+        ranges.append((media_type.strip().lower(), _quality(params)))
+    refused = {media_type for media_type, quality in ranges if quality <= 0}
+    # sorted() is stable, so equal q-values keep the client's order
+    for media_type, quality in sorted(ranges, key=lambda item: -item[1]):
+        if quality <= 0:
+            break
+        if media_type in ("*/*", "application/*"):
+            candidates = [candidate for candidate in available if candidate not in refused]
+        else:
+            candidates = [media_type] if media_type in available else []
+        if candidates:
+            return candidates[0]
+    raise HTTPException(status_code=406, detail=f"Acceptable media types: {', '.join(available)}")
+
+
+def render(model: Type[BaseModel], rows: Iterable, media_type: str = JSON, headers=None) -> Response:
+    encoder = encoder_for(model)
+    if media_type == COLUMNAR_JSON:
+        body = dumps(encoder.columns(rows))
+    elif media_type == MSGPACK:
+        body = msgpack.packb(encoder.objects(rows))
+    else:
+        body = dumps(encoder.objects(rows))
+    return Response(content=body, media_type=media_type, headers=dict(headers or {}))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """"br" or "gzip" if the client accepts it (brotli preferred), else None for identity."""
+    accepted = set()
+    for coding in (accept_encoding or "").lower().split(","):
+        name, _, params = coding.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+async def compress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    """Compress a body as it is produced, so large responses are never held in memory whole."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, finish = compressor.compress, compressor.flush
+    async for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
@@ -0,0 +1,162 @@
+import html
+import re
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Optional
+from urllib.parse import urljoin
+
+
+ATTR_PATTERN = r"""\b(?P<attr>href|src|srcset|style)(?P<eq>\s*=\s*)(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)')"""
+
+# One pattern for everything the proxy rewrites. A <base> tag is consumed
+# whole so its href can move the base URL for the rest of the document, and
+# <link> tags are consumed whole because their href is a subresource.
+REWRITE_PATTERN = re.compile(
+    r"""(?P<base><base\b[^>]*>)|(?P<link><link\b[^>]*>)|""" + ATTR_PATTERN,
+    re.IGNORECASE,
+)
+LINK_ATTR_PATTERN = re.compile(ATTR_PATTERN, re.IGNORECASE)
+BASE_HREF_PATTERN = re.compile(r"""\bhref(\s*=\s*)(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+STYLE_URL_PATTERN = re.compile(r"""url\(\s*(['"]?)([^'")]*)\1\s*\)""", re.IGNORECASE)
+CSS_IMPORT_PATTERN = re.compile(r"""@import\s+(['"])([^'"]*)\1""", re.IGNORECASE)
+
+# URLs that never point at something the proxy could fetch
+LOCAL_PREFIXES = ("data:", "javascript:", "#", "mailto:", "tel:", "blob:")
+SKIPPED_PREFIXES = LOCAL_PREFIXES + ("http://", "https://", "//")
+
+# Upper bound on text held back while waiting for a tag to close
+MAX_PENDING = 64 * 1024
+
+
+@lru_cache(maxsize=8192)
+def resolve_url(base_url: str, value: str) -> str:
+    return urljoin(base_url, value)
+
+
+class HtmlRewriter:
+    """
+    Single-pass rewriter that turns relative URLs into absolute ones.
+    Fed decoded chunks as they arrive; text after the last complete tag
+    is held back so attributes split across chunks are still rewritten.
+
+    When asset_url is given, subresources (src, srcset, style url() and
+    <link href>) are additionally passed through it, e.g. to route them
+    through the same-origin asset proxy. Navigation links are left alone.
+    """
+
+    def __init__(self, base_url: str, asset_url: Optional[Callable[[str], str]] = None):
+        self.document_url = base_url
+        self.base_url = base_url
+        self.asset_url = asset_url
+        self._pending = ""
+
+    def rewrite_url(self, value: str, asset: bool = False) -> str:
+        stripped = value.strip()
+        lowered = stripped.lower()
+        if asset and self.asset_url and stripped and not lowered.startswith(LOCAL_PREFIXES):
+            absolute = resolve_url(self.base_url, html.unescape(stripped))
+            if absolute.startswith(("http://", "https://")):
+                return self.asset_url(absolute)
+        if not stripped or lowered.startswith(SKIPPED_PREFIXES):
+            return value
+        return resolve_url(self.base_url, stripped)
+
+    def _rewrite_srcset(self, value: str) -> str:
+        if "data:" in value:
+            return value
+        candidates = []
+        for candidate in value.split(","):
+            parts = candidate.strip().split(None, 1)
+            if not parts:
+                continue
+            parts[0] = self.rewrite_url(parts[0], asset=True)
+            candidates.append(" ".join(parts))
+        return ", ".join(candidates)
+
+    def rewrite_style(self, value: str) -> str:
+        def replace(match):
+            quote, url_value = match.group(1), match.group(2)
+            return f"url({quote}{self.rewrite_url(url_value, asset=True)}{quote})"
+        return STYLE_URL_PATTERN.sub(replace, value)
+
+    def _rewrite_base(self, tag: str) -> str:
+        match = BASE_HREF_PATTERN.search(tag)
+        if not match:
+            return tag
+        href = match.group(2) if match.group(2) is not None else match.group(3)
+        # The base href itself resolves against the document URL
+        self.base_url = resolve_url(self.document_url, href.strip())
+        quote = '"' if match.group(2) is not None else "'"
+        replacement = f"href{match.group(1)}{quote}{self.base_url}{quote}"
+        return tag[:match.start()] + replacement + tag[match.end():]
+
+    def _rewrite_attr(self, match, link: bool = False) -> str:
+        attr = match.group("attr")
+        if match.group("dq") is not None:
+            quote, value = '"', match.group("dq")
+        else:
+            quote, value = "'", match.group("sq")
+
+        name = attr.lower()
+        if name == "style":
+            new_value = self.rewrite_style(value)
+        elif name == "srcset":
+            new_value = self._rewrite_srcset(value)
+        else:
+            new_value = self.rewrite_url(value, asset=link or name == "src")
+        if new_value == value:
+            return match.group(0)
+        return f"{attr}{match.group('eq')}{quote}{new_value}{quote}"
+
+    def _replace(self, match) -> str:
+        if match.group("base"):
+            return self._rewrite_base(match.group("base"))
+        if match.group("link"):
+            return LINK_ATTR_PATTERN.sub(lambda m: self._rewrite_attr(m, link=True), match.group("link"))
+        return self._rewrite_attr(match)
+
+    def feed(self, chunk: str) -> str:
+        data = self._pending + chunk
+        cut = data.rfind(">") + 1
+        if cut == 0 and len(data) < MAX_PENDING:
+            self._pending = data
+            return ""
+        if cut == 0:
+            cut = len(data)
+        self._pending = data[cut:]
+        return REWRITE_PATTERN.sub(self._replace, data[:cut])
+
+    def close(self) -> str:
+        data, self._pending = self._pending, ""
+        return REWRITE_PATTERN.sub(self._replace, data)
+
+
+def rewrite_html(content: str, base_url: str, asset_url: Optional[Callable[[str], str]] = None) -> str:
+    rewriter = HtmlRewriter(base_url, asset_url)
+    return rewriter.feed(content) + rewriter.close()
+
+
+async def rewrite_stream(
+    chunks: AsyncIterator[str],
+    base_url: str,
+    asset_url: Optional[Callable[[str], str]] = None,
+) -> AsyncIterator[str]:
+    rewriter = HtmlRewriter(base_url, asset_url)
+    async for chunk in chunks:
+        output = rewriter.feed(chunk)
+        if output:
+            yield output
+    tail = rewriter.close()
+    if tail:
+        yield tail
+
+
+def rewrite_css(content: str, base_url: str, asset_url: Optional[Callable[[str], str]] = None) -> str:
+    """Resolve url() and @import references in a stylesheet against its own URL."""
+    rewriter = HtmlRewriter(base_url, asset_url)
+
+    def replace_import(match):
+        quote, value = match.group(1), match.group(2)
+        return f"@import {quote}{rewriter.rewrite_url(value, asset=True)}{quote}"
+
+    content = rewriter.rewrite_style(content)
+    return CSS_IMPORT_PATTERN.sub(replace_import, content)
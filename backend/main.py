@@ -1,16 +1,38 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from typing import List, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.exc import IntegrityError
+import asyncio
+import base64
+import heapq
+import json
+import math
+import os
 import uuid
-from datetime import datetime
-from urllib.parse import urlparse, urljoin
+from datetime import datetime, timezone
+from urllib.parse import urlparse, quote
+from contextlib import AsyncExitStack
+import anyio
 import httpx
-import re
+
+from proxy_client import proxy_client
+from proxy_cache import CacheEntry, normalize_url, proxy_cache
+from html_rewriter import rewrite_css, rewrite_stream
+from asset_cache import AssetRecord, PROXY_ASSET_BROWSER_MAX_AGE, asset_cache
+from singleflight import SingleFlight
+from migrations import run_migrations
+from realtime import REALTIME_KEEPALIVE, hub, page_channel
+import polyline
+from polyline import STROKE_SIMPLIFY_TOLERANCE, STROKE_STORAGE_ENCODING
+from spatial import Box, PageAnnotations, segment_box, viewport_cache
+import search
+import encoders
+from cascade import deletion_jobs
+from row_cache import row_cache
+from database import engine, AsyncSessionLocal
 
 from models import (
     User, UserCreate, UserResponse,
@@ -18,21 +40,14 @@ from models import (
     ProjectShare,
     Comment, CommentCreate, CommentUpdate, CommentResponse,
     Line, LineCreate, LineUpdate, LineResponse,
+    StrokeCreate, StrokeResponse,
+    SearchResult, SearchResponse,
     ShareRequest, ShareResponse,
     Page, PageCreate, PageUpdate, PageResponse,
-)
-
-DATABASE_URL = "sqlite+aiosqlite:///./annotate.db"
-ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./annotate.db"
-
-engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
-async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
-
-AsyncSessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=async_engine,
-    class_=AsyncSession
+    PageChangesResponse,
+    BatchRequest, BatchResponse,
+    DeleteResponse, DeletionJobResponse,
+    SnapshotPage, SnapshotResponse,
 )
 
 app = FastAPI(title="Annotate API")
@@ -43,23 +58,82 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
-# Proxy endpoint to fetch external URLs and serve them from same origin
-@app.get("/proxy")
-async def proxy(url: str):
-    """
-    Proxy endpoint to fetch external URLs.
-    Makes iframes same-origin, enabling scroll sync.
-    """
+# In-flight upstream fetches, so concurrent viewers of one page share a single fetch
+proxy_flights = SingleFlight()
+asset_flights = SingleFlight()
+
+# Route page subresources through /proxy/asset unless the caller says otherwise
+PROXY_REWRITE_ASSETS = os.getenv("PROXY_REWRITE_ASSETS", "0").lower() in ("1", "true", "yes")
+
+# Largest page a paginated listing will return
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "500"))
+
+# Browser cache lifetime for revision-tagged reads; 0 means revalidate every time
+API_CACHE_MAX_AGE = int(os.getenv("API_CACHE_MAX_AGE", "0"))
+
+# Part of every ETag; bump when a response shape changes so old tags stop matching
+ETAG_VERSION = "1"
+
+# Upper bound on creates + updates + deletes in one POST /projects/{id}/batch
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "5000"))
+
+# Headers that must not be copied from the upstream response onto a rewritten page
+STRIPPED_PROXY_HEADERS = {
+    "x-frame-options",
+    "content-security-policy",
+    "content-security-policy-report-only",
+    "content-length",
+    "content-encoding",
+    "transfer-encoding",
+    "connection",
+    "keep-alive",
+}
+
+# Per-client headers kept off cached pages, which every reviewer is served
+UNSHARED_PROXY_HEADERS = {"set-cookie", "set-cookie2"}
+
+# Connection-level headers that never apply to the response we send back
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "upgrade",
+}
+
+# Request headers forwarded upstream so range requests work for large assets
+FORWARDED_REQUEST_HEADERS = ("range", "if-range")
+
+# Encodings browsers decode themselves; anything else is decoded here
+PASSTHROUGH_ENCODINGS = {"gzip", "deflate", "br", "identity"}
+
+
+def passthrough_headers(response: httpx.Response, decoded: bool) -> dict:
+    headers = {
+        k: v for k, v in response.headers.items()
+        if k.lower() not in HOP_BY_HOP_HEADERS
+    }
+    if decoded:
+        headers.pop("content-encoding", None)
+        headers.pop("content-length", None)
+    return headers
+
+
+def validate_proxy_url(url: str):
     if not url:
         raise HTTPException(status_code=400, detail="URL parameter is required")
-    
+
     # Ensure URL has a scheme
     if not url.startswith("http://") and not url.startswith("https://"):
         url = "https://" + url
-    
+
     # Validate URL
     try:
         parsed = urlparse(url)
@@ -67,75 +141,316 @@ async def proxy(url: str):
             raise HTTPException(status_code=400, detail="Invalid URL")
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid URL")
+
+    return url, parsed.netloc
+
+
+def asset_proxy_url(url: str) -> str:
+    return f"/proxy/asset?url={quote(url, safe='')}"
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that closes `stack` once it has been sent or abandoned.
+
+    Cleanup cannot live in the body generator's finally: a client that
+    disconnects before the first chunk cancels the response before the
+    generator has started, and the finally never runs.
+    """
+
+    def __init__(self, content, stack: AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.stack = stack
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                # Finish the body first, so nothing still reads from what the stack holds
+                close_body = getattr(self.body_iterator, "aclose", None)
+                if close_body is not None:
+                    await close_body()
+                await self.stack.aclose()
+
+
+def shared_headers(headers: dict) -> dict:
+    return {k: v for k, v in headers.items() if k.lower() not in UNSHARED_PROXY_HEADERS}
+
+
+def cached_response(entry: CacheEntry, status: str) -> Response:
+    # Entries stored before Set-Cookie was stripped may still carry it
+    headers = shared_headers(entry.headers)
+    headers["x-proxy-cache"] = status
+    return Response(content=entry.content, status_code=entry.status_code, headers=headers)
+
+
+# Proxy endpoint to fetch external URLs and serve them from same origin
+@app.get("/proxy")
+async def proxy(url: str, request: Request, assets: bool = PROXY_REWRITE_ASSETS):
+    """
+    Proxy endpoint to fetch external URLs.
+    Makes iframes same-origin, enabling scroll sync.
+    With assets=true, subresources are routed through /proxy/asset as well.
+    """
+    url, original_host = validate_proxy_url(url)
+    cache_key = normalize_url(url)
+    if assets:
+        cache_key += "#assets"
+
+    # Serve fresh pages from cache, revalidate stale ones with a conditional GET
+    cached = await proxy_cache.get(cache_key)
+    if cached and cached.is_fresh(proxy_cache.ttl):
+        proxy_cache.hits += 1
+        return cached_response(cached, "HIT")
+
+    # Coalesce concurrent fetches of the same page; range requests always go upstream
+    ranged = "range" in request.headers
+    leader = not ranged and proxy_flights.start(cache_key)
+    if not ranged and not leader:
+        await proxy_flights.wait(cache_key)
+        cached = await proxy_cache.get(cache_key)
+        if cached and cached.is_fresh(proxy_cache.ttl):
+            proxy_cache.hits += 1
+            return cached_response(cached, "COALESCED")
     
-    original_host = parsed.netloc
-    
+    stack = AsyncExitStack()
+    if leader:
+        stack.callback(proxy_flights.finish, cache_key)
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, follow_redirects=True)
+        request_headers = cached.validators() if cached else {}
+        for name in FORWARDED_REQUEST_HEADERS:
+            if name in request.headers:
+                request_headers[name] = request.headers[name]
+        if "range" in request_headers:
+            # Byte ranges only make sense against the unencoded representation
+            request_headers["accept-encoding"] = "identity"
+        response = await stack.enter_async_context(
+            proxy_client.stream(url, original_host, headers=request_headers)
+        )
+
+        if cached and response.status_code == 304:
+            proxy_cache.hits += 1
+            # Refreshed before the flight ends, so followers find it fresh
+            await proxy_cache.refresh(cache_key, cached)
+            await stack.aclose()
+            return cached_response(cached, "REVALIDATED")
         
-        content = response.text
         content_type = response.headers.get("content-type", "")
         
-        # Only proxy HTML content
+        # Only rewrite HTML content; everything else streams through untouched
         if "text/html" not in content_type:
-            return Response(
-                content=content,
+            encoding = response.headers.get("content-encoding", "identity").lower()
+            accepted = request.headers.get("accept-encoding", "").lower()
+            decoded = encoding != "identity" and (
+                encoding not in PASSTHROUGH_ENCODINGS or encoding not in accepted
+            )
+            chunks = response.aiter_bytes() if decoded else response.aiter_raw()
+            # Never cached, so followers need not wait for this download
+            if leader:
+                proxy_flights.finish(cache_key)
+            return ClosingStreamingResponse(
+                chunks,
+                stack,
                 status_code=response.status_code,
-                headers=dict(response.headers),
+                headers=passthrough_headers(response, decoded),
             )
         
         # Remove X-Frame-Options, CSP headers that block iframes, and transfer encoding headers
-        headers = dict(response.headers)
-        headers.pop("x-frame-options", None)
-        headers.pop("content-security-policy", None)
-        headers.pop("content-security-policy-report-only", None)
-        headers.pop("content-length", None)
-        headers.pop("transfer-encoding", None)
-        
-        # Rewrite relative URLs to absolute URLs
-        def replace_url(match):
-            attr = match.group(1)  # href, src, etc.
-            url_value = match.group(2)
-            
-            # Skip data: URLs, javascript:, #
-            if url_value.startswith("data:") or url_value.startswith("javascript:") or url_value.startswith("#"):
-                return match.group(0)
-            
-            # Skip absolute URLs
-            if url_value.startswith("http://") or url_value.startswith("https://") or url_value.startswith("//"):
-                return match.group(0)
-            
-            # Skip URLs that are just fragments
-            if url_value.startswith("#"):
-                return match.group(0)
-            
-            # Convert relative to absolute
-            absolute_url = urljoin(url, url_value)
-            return f'{attr}="{absolute_url}"'
-        
-        # Rewrite href and src attributes
-        content = re.sub(r'(href|src)="([^"]*)"', replace_url, content)
-        
-        # Rewrite style attributes that contain URLs
-        def replace_style_urls(style_value):
-            def replace_url_in_style(match):
-                url_content = match.group(1)
-                return f"url({urljoin(url, url_content)})"
-            return re.sub(r"url\(['\"]?([^'\")\s]*)['\"]?\)", replace_url_in_style, style_value)
-        
-        content = re.sub(r'style="([^"]*)"', lambda m: f'style="{replace_style_urls(m.group(1))}"', content)
-        
-        return Response(
-            content=content,
-            status_code=response.status_code,
-            headers=headers,
+        headers = {
+            k: v for k, v in response.headers.items()
+            if k.lower() not in STRIPPED_PROXY_HEADERS
+        }
+        # The rewritten body is always re-encoded as UTF-8
+        headers["content-type"] = "text/html; charset=utf-8"
+        status_code = response.status_code
+        cache_control = response.headers.get("cache-control", "").lower()
+        # no-store and private both mean the page must not be served to other users
+        uncacheable = "no-store" in cache_control or "private" in cache_control
+        cacheable = status_code == 200 and not uncacheable
+        if cacheable:
+            # Only pages the cache could have served count towards its hit rate
+            proxy_cache.misses += 1
+        elif leader:
+            proxy_flights.finish(cache_key)
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+    except httpx.TimeoutException:
+        await stack.aclose()
+        raise HTTPException(status_code=504, detail="Request timed out")
+    except httpx.RequestError as e:
+        await stack.aclose()
+        raise HTTPException(status_code=502, detail=f"Failed to fetch URL: {str(e)}")
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def body():
+        # Rewrite while streaming; keep a copy for the cache unless the page is too large
+        parts = []
+        size = 0
+        asset_url = asset_proxy_url if assets else None
+        async for piece in rewrite_stream(response.aiter_text(), url, asset_url):
+            chunk = piece.encode("utf-8")
+            if cacheable and size <= proxy_cache.max_entry_bytes:
+                parts.append(chunk)
+                size += len(chunk)
+            yield chunk
+
+        if cacheable and size <= proxy_cache.max_entry_bytes:
+            await proxy_cache.put(cache_key, CacheEntry(
+                content=b"".join(parts),
+                status_code=status_code,
+                headers=shared_headers(headers),
+                etag=etag,
+                last_modified=last_modified,
+            ))
+        elif uncacheable:
+            # Other statuses (a 206, a passing 5xx) leave a good cached copy in place
+            await proxy_cache.delete(cache_key)
+
+    return ClosingStreamingResponse(
+        body(),
+        stack,
+        status_code=status_code,
+        headers={**headers, "x-proxy-cache": "MISS"},
+    )
+
+
+def asset_headers(content_type: str, status: str) -> dict:
+    # content-type is passed as a header so Starlette does not append a second charset
+    return {
+        "content-type": content_type,
+        "cache-control": f"public, max-age={PROXY_ASSET_BROWSER_MAX_AGE}",
+        "x-proxy-cache": status,
+    }
+
+
+def asset_response(record: AssetRecord, request: Request, status: str) -> Response:
+    headers = asset_headers(record.content_type, status)
+    headers["etag"] = f'"{record.digest}"'
+    if request.headers.get("if-none-match") == headers["etag"]:
+        headers.pop("content-type")
+        return Response(status_code=304, headers=headers)
+    return FileResponse(asset_cache.blob_path(record.digest), headers=headers)
+
+
+@app.get("/proxy/asset")
+async def proxy_asset(url: str, request: Request):
+    """
+    Same-origin proxy for page subresources, backed by the shared
+    content-addressed asset cache.
+    """
+    url, original_host = validate_proxy_url(url)
+    cache_key = normalize_url(url)
+
+    cached = await asset_cache.lookup(cache_key)
+    if cached and cached.is_fresh(asset_cache.ttl):
+        asset_cache.hits += 1
+        return asset_response(cached, request, "HIT")
+
+    # Coalesce concurrent fetches of the same asset
+    leader = asset_flights.start(cache_key)
+    if not leader:
+        await asset_flights.wait(cache_key)
+        cached = await asset_cache.lookup(cache_key)
+        if cached and cached.is_fresh(asset_cache.ttl):
+            asset_cache.hits += 1
+            return asset_response(cached, request, "COALESCED")
+
+    stack = AsyncExitStack()
+    if leader:
+        stack.callback(asset_flights.finish, cache_key)
+    try:
+        request_headers = cached.validators() if cached else {}
+        response = await stack.enter_async_context(
+            proxy_client.stream(url, original_host, headers=request_headers)
         )
-        
+
+        if cached and response.status_code == 304:
+            await stack.aclose()
+            asset_cache.hits += 1
+            await asset_cache.touch(cache_key, cached)
+            return asset_response(cached, request, "REVALIDATED")
+        asset_cache.misses += 1
+
+        if response.status_code != 200:
+            # Not cached, so followers need not wait for this download
+            if leader:
+                asset_flights.finish(cache_key)
+            return ClosingStreamingResponse(
+                response.aiter_bytes(),
+                stack,
+                status_code=response.status_code,
+                headers=passthrough_headers(response, decoded=True),
+            )
+
+        content_type = response.headers.get("content-type", "application/octet-stream")
+        record = AssetRecord(
+            digest="",
+            size=0,
+            content_type=content_type,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+        )
+
+        # Stylesheets resolve url() against their own URL, which is now ours,
+        # so they are rewritten in full before being cached
+        if "text/css" in content_type:
+            content = await response.aread()
+            await stack.aclose()
+            css = content.decode(response.encoding or "utf-8", errors="replace")
+            body = rewrite_css(css, url, asset_proxy_url).encode("utf-8")
+            record.content_type = "text/css; charset=utf-8"
+            await asset_cache.store(cache_key, body, record)
+            return Response(content=body, headers=asset_headers(record.content_type, "MISS"))
     except httpx.TimeoutException:
+        await stack.aclose()
         raise HTTPException(status_code=504, detail="Request timed out")
     except httpx.RequestError as e:
+        await stack.aclose()
         raise HTTPException(status_code=502, detail=f"Failed to fetch URL: {str(e)}")
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def body():
+        # Stream to the client while spooling into the cache. The temp file is
+        # opened in a worker thread, so a disconnect must not drop it half-made
+        with anyio.CancelScope(shield=True):
+            writer = await asset_cache.writer()
+        try:
+            async for chunk in response.aiter_bytes():
+                await writer.write(chunk)
+                yield chunk
+        except BaseException:
+            writer.discard()
+            raise
+        if writer.overflow:
+            return
+        record.digest = writer.digest
+        record.size = writer.size
+        await asset_cache.commit(cache_key, writer, record)
+
+    return ClosingStreamingResponse(
+        body(),
+        stack,
+        headers=asset_headers(content_type, "MISS"),
+    )
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"rows": row_cache.stats(), "viewport": viewport_cache.stats()}
+
+
+@app.get("/proxy/stats")
+async def proxy_stats():
+    return {
+        "cache": proxy_cache.stats(),
+        "assets": asset_cache.stats(),
+        "coalescing": {"pages": proxy_flights.stats(), "assets": asset_flights.stats()},
+    }
 
 
 async def get_db():
@@ -152,69 +467,477 @@ def format_datetime(dt):
     return dt.isoformat()
 
 
-@app.on_event("startup")
-async def startup():
-    async with async_engine.begin() as conn:
-        await conn.run_sync(User.__table__.create, checkfirst=True)
-        await conn.run_sync(Project.__table__.create, checkfirst=True)
-        await conn.run_sync(Page.__table__.create, checkfirst=True)
-        await conn.run_sync(ProjectShare.__table__.create, checkfirst=True)
-        await conn.run_sync(Comment.__table__.create, checkfirst=True)
-        await conn.run_sync(Line.__table__.create, checkfirst=True)
+def build_set_clause(update_data: dict) -> str:
+    # Quote column names so reserved words like "order" work on every backend
+    return ", ".join(f'"{k}" = :{k}' for k in update_data)
+
+
+def row_data(row) -> dict:
+    # SQLite hands back timestamps as strings, PostgreSQL as datetimes
+    mapping = row if isinstance(row, dict) else row._mapping
+    return {
+        k: format_datetime(v) if isinstance(v, datetime) else v
+        for k, v in mapping.items()
+    }
+
+
+def insert_sql(table: str, row: dict) -> str:
+    columns = ", ".join(f'"{k}"' for k in row)
+    values = ", ".join(f":{k}" for k in row)
+    return f"INSERT INTO {table} ({columns}) VALUES ({values})"
+
+
+# Project rows with their counters and owner name in a single statement.
+# Counters are stored on the project row (see bump_project), so listing
+# never touches the comments, pages or lines tables.
+PROJECT_SUMMARY_COLUMNS = """
+    p.id, p.user_id, p.title, p.created_at, p.updated_at,
+    p.comment_count, p.open_comment_count, p.page_count, p.line_count, p.revision,
+    COALESCE(u.name, 'Unknown') AS owner_name
+"""
+PROJECT_SUMMARY_SELECT = f"""
+    SELECT {PROJECT_SUMMARY_COLUMNS}
+    FROM projects p
+    LEFT JOIN users u ON u.id = p.user_id
+"""
+
+# Listings are newest first and paginated by keyset on (timestamp, id);
+# keyset_sql adds the cursor condition, ORDER BY and LIMIT
+USER_PROJECTS_SQL = PROJECT_SUMMARY_SELECT + " WHERE p.user_id = :user_id"
+USER_PROJECTS_KEYSET = ("p.updated_at", "p.id")
+
+SHARED_PROJECTS_SQL = f"""
+    SELECT {PROJECT_SUMMARY_COLUMNS}, ps.created_at AS shared_at
+    FROM project_shares ps
+    JOIN projects p ON p.id = ps.project_id
+    LEFT JOIN users u ON u.id = p.user_id
+    WHERE ps.shared_with_user_id = :user_id
+"""
+SHARED_PROJECTS_KEYSET = ("ps.created_at", "ps.project_id")
+
+# Everything CommentResponse needs; listed so search columns (search_rowid,
+# PostgreSQL's search_vector) never leave the database
+COMMENT_COLUMNS = "id, project_id, page_id, x, y, text, author, resolved, created_at, updated_at, revision"
+
+# Hot per-page reads, served by the (project_id, page_id, created_at) indexes
+COMMENTS_BY_PAGE_SQL = f"SELECT {COMMENT_COLUMNS} FROM comments WHERE project_id = :project_id AND page_id = :page_id"
+COMMENTS_KEYSET = ("created_at", "id")
+LINES_BY_PAGE_SQL = "SELECT * FROM lines WHERE project_id = :project_id AND page_id = :page_id ORDER BY created_at ASC"
+STROKES_BY_PAGE_SQL = "SELECT * FROM strokes WHERE project_id = :project_id AND page_id = :page_id ORDER BY created_at ASC"
+PAGES_BY_PROJECT_SQL = 'SELECT * FROM pages WHERE project_id = :project_id ORDER BY "order" ASC'
+
+# A whole project's annotations, one query per table, each grouped by page
+# (the comments query walks the index backwards for get_comments' newest-first order)
+SNAPSHOT_COMMENTS_SQL = f"SELECT {COMMENT_COLUMNS} FROM comments WHERE project_id = :project_id ORDER BY page_id DESC, created_at DESC, id DESC"
+SNAPSHOT_LINES_SQL = "SELECT * FROM lines WHERE project_id = :project_id ORDER BY page_id, created_at"
+SNAPSHOT_STROKES_SQL = "SELECT * FROM strokes WHERE project_id = :project_id ORDER BY page_id, created_at"
+SNAPSHOT_BATCH_ROWS = 1000
+USER_BY_NAME_SQL = "SELECT * FROM users WHERE name = :name"
+
+# The slowly-changing columns kept in row_cache
+USER_METADATA_SQL = "SELECT id, name, created_at FROM users WHERE id = :id"
+PROJECT_METADATA_SQL = "SELECT id, user_id, title, created_at FROM projects WHERE id = :id"
+PAGE_METADATA_SQL = 'SELECT id, project_id, url, title, "order", created_at FROM pages WHERE id = :id'
+
+# Returned by project updates so the response has what PROJECT_SUMMARY_SELECT gives
+PROJECT_RETURNING = "*, (SELECT name FROM users u WHERE u.id = projects.user_id) AS owner_name"
+
+# Moves the open-comment counter only if the comment's resolved flag actually changes
+COMMENT_RESOLVED_COUNTER_SQL = """
+    UPDATE projects SET open_comment_count = open_comment_count + :delta, revision = revision + 1
+    WHERE id = (SELECT project_id FROM comments WHERE id = :id AND resolved != :resolved)
+"""
+
+# A new page, numbered after the project's last one; inserts nothing if the project does not exist
+PAGE_INSERT_SQL = """
+    INSERT INTO pages (id, project_id, url, title, "order", created_at)
+    SELECT :id, p.id, :url, COALESCE(CAST(:title AS VARCHAR), 'Page ' || (n.next_order + 1)), n.next_order, :now
+    FROM projects p, (SELECT COALESCE(MAX("order"), -1) + 1 AS next_order FROM pages WHERE project_id = :project_id) n
+    WHERE p.id = :project_id
+    RETURNING *
+"""
+
+# Get-or-create on users.name; the no-op update makes RETURNING yield an existing row too
+USER_UPSERT_SQL = """
+    INSERT INTO users (id, name, created_at) VALUES (:id, :name, :now)
+    ON CONFLICT (name) DO UPDATE SET name = excluded.name
+    RETURNING id, name, created_at
+"""
+
+# Get-or-create on (user_id, title), touching an existing project; inserts nothing for an unknown user
+PROJECT_UPSERT_SQL = """
+    INSERT INTO projects (id, user_id, title, created_at, updated_at)
+    SELECT :id, u.id, :title, :now, :now FROM users u WHERE u.id = :user_id
+    ON CONFLICT (user_id, title) DO UPDATE
+        SET updated_at = excluded.updated_at, revision = projects.revision + 1
+    RETURNING *, NULL AS owner_name
+"""
+
+# What a page's annotations add to its project's counters
+PAGE_ANNOTATION_COUNTS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM comments WHERE project_id = :project_id AND page_id = :page_id) AS comments,
+        (SELECT COUNT(*) FROM comments WHERE project_id = :project_id AND page_id = :page_id AND NOT resolved) AS open_comments,
+        (SELECT COUNT(*) FROM lines WHERE project_id = :project_id AND page_id = :page_id) AS lines,
+        (SELECT COUNT(*) FROM strokes WHERE project_id = :project_id AND page_id = :page_id) AS strokes
+"""
+
+# Incremental sync, served by the (project_id, page_id, revision) indexes
+COMMENTS_SINCE_SQL = f"SELECT {COMMENT_COLUMNS} FROM comments WHERE project_id = :project_id AND page_id = :page_id AND revision > :since ORDER BY revision"
+LINES_SINCE_SQL = "SELECT * FROM lines WHERE project_id = :project_id AND page_id = :page_id AND revision > :since ORDER BY revision"
+STROKES_SINCE_SQL = "SELECT * FROM strokes WHERE project_id = :project_id AND page_id = :page_id AND revision > :since ORDER BY revision"
+# Projects a user can see: owned plus shared with them
+ACCESSIBLE_PROJECTS_SQL = """
+    SELECT id FROM projects WHERE user_id = :user_id
+    UNION
+    SELECT project_id FROM project_shares WHERE shared_with_user_id = :user_id
+"""
+PAGE_REVISION_SQL = """
+    SELECT pg.revision FROM pages pg
+    JOIN projects p ON p.id = pg.project_id
+    WHERE pg.id = :page_id AND pg.project_id = :project_id
+"""
+PAGE_REVISION_BUMP_SQL = """
+    UPDATE pages SET revision = revision + 1
+    WHERE id = :page_id AND project_id = :project_id
+      AND EXISTS (SELECT 1 FROM projects WHERE id = :project_id)
+    RETURNING revision
+"""
+TOMBSTONE_INSERT_SQL = """
+    INSERT INTO tombstones (id, project_id, page_id, kind, entity_id, revision, deleted_at)
+    VALUES (:id, :project_id, :page_id, :kind, :entity_id, :revision, :now)
+"""
+TOMBSTONES_SINCE_SQL = "SELECT kind, entity_id FROM tombstones WHERE project_id = :project_id AND page_id = :page_id AND revision > :since ORDER BY revision"
+SHARE_INSERT_SQL = """
+    INSERT INTO project_shares (id, project_id, shared_with_user_id, created_at)
+    SELECT :id, :project_id, :user_id, :now
+    WHERE EXISTS (SELECT 1 FROM projects WHERE id = :project_id)
+"""
+SHARE_LOOKUP_SQL = "SELECT * FROM project_shares WHERE project_id = :project_id AND shared_with_user_id = :user_id"
+
+
+def utc_naive(dt: datetime) -> datetime:
+    # Timestamps are stored as naive UTC
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def encode_cursor(timestamp, row_id: str) -> str:
+    raw = json.dumps([format_datetime(timestamp), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return utc_naive(datetime.fromisoformat(timestamp)), str(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_sql(sql: str, keyset: Tuple[str, str], after: bool, limit: bool) -> str:
+    """Newest-first ordering on (timestamp, id), optionally after a cursor and limited."""
+    timestamp, row_id = keyset
+    if after:
+        sql += f" AND ({timestamp}, {row_id}) < (:after_time, :after_id)"
+    sql += f" ORDER BY {timestamp} DESC, {row_id} DESC"
+    if limit:
+        sql += " LIMIT :limit"
+    return sql
+
+
+async def fetch_page(db: AsyncSession, sql: str, params: dict, keyset: Tuple[str, str],
+                     after: Optional[str], limit: Optional[int]) -> list:
+    """
+    Run a listing query one page at a time. One extra row is fetched to
+    tell whether another page follows.
+    """
+    params = dict(params)
+    if after:
+        params["after_time"], params["after_id"] = decode_cursor(after)
+    if limit:
+        params["limit"] = limit + 1
+    statement = text(keyset_sql(sql, keyset, bool(after), bool(limit)))
+    # Bind timestamps the way the DateTime columns store them
+    for name, value in params.items():
+        if isinstance(value, datetime):
+            statement = statement.bindparams(bindparam(name, type_=DateTime))
+    result = await db.execute(statement, params)
+    return result.fetchall()
+
+
+def next_page(rows: list, limit: Optional[int], response: Response, cursor) -> list:
+    """Trim the look-ahead row and advertise the next cursor, if there is one."""
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(*cursor(rows[-1]))
+    return rows
+
+
+def project_response(row) -> ProjectResponse:
+    return ProjectResponse(
+        id=row.id,
+        user_id=row.user_id,
+        title=row.title,
+        created_at=format_datetime(row.created_at),
+        updated_at=format_datetime(row.updated_at),
+        comment_count=row.comment_count,
+        open_comment_count=row.open_comment_count,
+        page_count=row.page_count,
+        line_count=row.line_count,
+        owner_name=row.owner_name
+    )
 
 
-# User endpoints
+async def bump_project(db: AsyncSession, project_id: str, touch: bool = True, **deltas):
+    """Adjust a project's counters (and updated_at) and bump its revision inside the caller's transaction."""
+    assignments = ["revision = revision + 1"] + [f"{name} = {name} + :{name}" for name in deltas]
+    params = dict(deltas, id=project_id)
+    if touch:
+        assignments.append("updated_at = :now")
+        params["now"] = datetime.utcnow()
+    await db.execute(
+        text(f"UPDATE projects SET {', '.join(assignments)} WHERE id = :id"),
+        params
+    )
 
-@app.post("/users", response_model=UserResponse)
-async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
-    # Check if user with same name exists
+
+async def next_page_revision(db: AsyncSession, project_id: str, page_id: str) -> int:
+    """
+    Bump and return a page's revision inside the caller's transaction.
+
+    The row lock this takes orders concurrent writers on the same page, so
+    revisions become visible in the order they were handed out. It is also
+    the authoritative check that the page and its project still exist: the
+    row cache behind require_page may not have seen another worker's delete.
+    """
+    result = await db.execute(text(PAGE_REVISION_BUMP_SQL), {"project_id": project_id, "page_id": page_id})
+    revision = result.scalar()
+    if revision is None:
+        await row_cache.invalidate("project", project_id)
+        await row_cache.invalidate("page", page_id)
+        raise HTTPException(status_code=404, detail="Page not found")
+    return revision
+
+
+async def claim_page_revision(db: AsyncSession, table: str, entity_id: str, entity: str) -> int:
+    """
+    next_page_revision for the page an annotation is on; also the existence
+    check, raising a 404 naming `entity` if there is no such annotation.
+    """
     result = await db.execute(
-        text("SELECT * FROM users WHERE name = :name"),
-        {"name": user.name}
-    )
-    existing = result.fetchone()
-    if existing:
-        return UserResponse(
-            id=existing.id,
-            name=existing.name,
-            created_at=format_datetime(existing.created_at)
-        )
+        text(f"UPDATE pages SET revision = revision + 1 WHERE id = (SELECT page_id FROM {table} WHERE id = :id) "
+             "RETURNING revision"),
+        {"id": entity_id}
+    )
+    revision = result.scalar()
+    if revision is None:
+        raise HTTPException(status_code=404, detail=f"{entity} not found")
+    return revision
 
-    db_user = User(
-        id=str(uuid.uuid4()),
-        name=user.name,
-        created_at=datetime.utcnow()
+
+def where_clause(key: dict) -> str:
+    return " AND ".join(f'"{k}" = :key_{k}' for k in key)
+
+
+def key_params(key: dict) -> dict:
+    return {f"key_{k}": v for k, v in key.items()}
+
+
+async def row_or_404(db: AsyncSession, table: str, key: dict, entity: str, returning: str = "*"):
+    result = await db.execute(
+        text(f"SELECT {returning} FROM {table} WHERE {where_clause(key)}"),
+        key_params(key)
     )
-    db.add(db_user)
-    await db.commit()
-    await db.refresh(db_user)
-    return UserResponse(
-        id=db_user.id,
-        name=db_user.name,
-        created_at=format_datetime(db_user.created_at)
+    row = result.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail=f"{entity} not found")
+    return row
+
+
+async def update_returning(db: AsyncSession, table: str, key: dict, values: dict, entity: str,
+                           extra_set: str = "", returning: str = "*"):
+    """UPDATE the row matching `key` and return it as updated; 404 if there is none."""
+    assignments = [clause for clause in (build_set_clause(values), extra_set) if clause]
+    if not assignments:
+        return await row_or_404(db, table, key, entity, returning)
+    result = await db.execute(
+        text(f"UPDATE {table} SET {', '.join(assignments)} WHERE {where_clause(key)} RETURNING {returning}"),
+        dict(values, **key_params(key))
     )
+    row = result.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail=f"{entity} not found")
+    return row
 
 
-@app.get("/users/{user_id}", response_model=UserResponse)
-async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
+async def delete_returning(db: AsyncSession, table: str, key: dict, entity: str, returning: str = "*"):
+    """DELETE the row matching `key` and return what it held; 404 if there is none."""
     result = await db.execute(
-        text("SELECT * FROM users WHERE id = :id"),
-        {"id": user_id}
+        text(f"DELETE FROM {table} WHERE {where_clause(key)} RETURNING {returning}"),
+        key_params(key)
     )
     row = result.fetchone()
     if not row:
+        raise HTTPException(status_code=404, detail=f"{entity} not found")
+    return row
+
+
+def tombstone_params(kind: str, row, revision: int, now: datetime) -> dict:
+    return {"id": str(uuid.uuid4()), "project_id": row.project_id, "page_id": row.page_id,
+            "kind": kind, "entity_id": row.id, "revision": revision, "now": now}
+
+
+async def add_tombstone(db: AsyncSession, kind: str, row) -> int:
+    """Record a deleted annotation (any row with id, project_id and page_id) at a new page revision."""
+    revision = await next_page_revision(db, row.project_id, row.page_id)
+    await db.execute(text(TOMBSTONE_INSERT_SQL), tombstone_params(kind, row, revision, datetime.utcnow()))
+    return revision
+
+
+def revision_etag(scope: str, revision: int, media_type: str = encoders.JSON) -> str:
+    return f'W/"{ETAG_VERSION}-{scope}-{revision}{encoders.ETAG_VARIANTS[media_type]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" name the same representation
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def cache_headers(etag: str) -> dict:
+    cache_control = f"private, max-age={API_CACHE_MAX_AGE}" if API_CACHE_MAX_AGE else "private, no-cache"
+    return {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept"}
+
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """A 304 if the client already holds `etag`; otherwise put the cache headers on `response`."""
+    headers = cache_headers(etag)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def list_response(model, rows, media_type: str, response: Response) -> Response:
+    """Encode rows in `model`'s wire format, keeping headers already set on `response`."""
+    return encoders.render(model, rows, media_type, response.headers)
+
+
+def accepted_media_type(request: Request) -> str:
+    return encoders.negotiate(request.headers.get("accept"))
+
+
+async def page_revision(db: AsyncSession, project_id: str, page_id: str) -> Optional[int]:
+    result = await db.execute(text(PAGE_REVISION_SQL), {"project_id": project_id, "page_id": page_id})
+    return result.scalar()
+
+
+async def project_revision(db: AsyncSession, project_id: str) -> int:
+    result = await db.execute(
+        text("SELECT revision FROM projects WHERE id = :id"),
+        {"id": project_id}
+    )
+    revision = result.scalar()
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return revision
+
+
+async def cached_row(db: AsyncSession, kind: str, sql: str, row_id: str) -> Optional[dict]:
+    async def load():
+        result = await db.execute(text(sql), {"id": row_id})
+        row = result.fetchone()
+        return row_data(row) if row else None
+    return await row_cache.get(kind, row_id, load)
+
+
+async def require_user(db: AsyncSession, user_id: str) -> dict:
+    user = await cached_row(db, "user", USER_METADATA_SQL, user_id)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserResponse(
+    return user
+
+
+async def require_project(db: AsyncSession, project_id: str) -> dict:
+    project = await cached_row(db, "project", PROJECT_METADATA_SQL, project_id)
+    if project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project
+
+
+async def require_page(db: AsyncSession, project_id: str, page_id: str) -> dict:
+    """The page, checking it belongs to `project_id` and that the project still exists."""
+    await require_project(db, project_id)
+    page = await cached_row(db, "page", PAGE_METADATA_SQL, page_id)
+    if page is None or page["project_id"] != project_id:
+        raise HTTPException(status_code=404, detail="Page not found")
+    return page
+
+
+async def fetch_project(db: AsyncSession, project_id: str) -> ProjectResponse:
+    result = await db.execute(
+        text(PROJECT_SUMMARY_SELECT + " WHERE p.id = :id"),
+        {"id": project_id}
+    )
+    row = result.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project_response(row)
+
+
+@app.on_event("startup")
+async def startup():
+    async with engine.begin() as conn:
+        await run_migrations(conn)
+    await proxy_client.start()
+    await hub.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await proxy_client.close()
+    await hub.close()
+    await deletion_jobs.close()
+    await row_cache.close()
+
+
+# User endpoints
+
+@app.post("/users", response_model=UserResponse)
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    # Get-or-create on the unique name in one statement
+    result = await db.execute(
+        text(USER_UPSERT_SQL),
+        {"id": str(uuid.uuid4()), "name": user.name, "now": datetime.utcnow()}
+    )
+    row = result.one()
+    await db.commit()
+    response = UserResponse(
         id=row.id,
         name=row.name,
         created_at=format_datetime(row.created_at)
     )
+    await row_cache.put("user", response.id, response.model_dump())
+    return response
+
+
+@app.get("/users/{user_id}", response_model=UserResponse)
+async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
+    return UserResponse(**await require_user(db, user_id))
 
 
 @app.get("/users/by-name/{name}", response_model=UserResponse)
 async def get_user_by_name(name: str, db: AsyncSession = Depends(get_db)):
     result = await db.execute(
-        text("SELECT * FROM users WHERE name = :name"),
+        text(USER_BY_NAME_SQL),
         {"name": name}
     )
     row = result.fetchone()
@@ -231,268 +954,224 @@ async def get_user_by_name(name: str, db: AsyncSession = Depends(get_db)):
 
 @app.post("/users/{user_id}/projects", response_model=ProjectResponse)
 async def create_project(user_id: str, project: ProjectCreate, db: AsyncSession = Depends(get_db)):
-    # Check if user exists
+    # Create the project, or touch the user's existing one with this title;
+    # no row back means the user does not exist
     result = await db.execute(
-        text("SELECT * FROM users WHERE id = :id"),
-        {"id": user_id}
+        text(PROJECT_UPSERT_SQL),
+        {"id": str(uuid.uuid4()), "user_id": user_id, "title": project.title, "now": datetime.utcnow()}
     )
-    if not result.fetchone():
+    row = result.fetchone()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-
-    # Check if project with same title exists for this user
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE user_id = :user_id AND title = :title"),
-        {"user_id": user_id, "title": project.title}
-    )
-    existing = result.fetchone()
-    if existing:
-        # Update timestamp
-        await db.execute(
-            text("UPDATE projects SET updated_at = :now WHERE id = :id"),
-            {"id": existing.id, "now": datetime.utcnow()}
-        )
-        await db.commit()
-        return ProjectResponse(
-            id=existing.id,
-            user_id=existing.user_id,
-            title=existing.title,
-            created_at=format_datetime(existing.created_at),
-            updated_at=format_datetime(datetime.utcnow())
-        )
-
-    db_project = Project(
-        id=str(uuid.uuid4()),
-        user_id=user_id,
-        title=project.title,
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow()
-    )
-    db.add(db_project)
     await db.commit()
-    await db.refresh(db_project)
-
-    return ProjectResponse(
-        id=db_project.id,
-        user_id=db_project.user_id,
-        title=db_project.title,
-        created_at=format_datetime(db_project.created_at),
-        updated_at=format_datetime(db_project.updated_at)
-    )
+    return project_response(row)
 
 
 @app.get("/users/{user_id}/projects", response_model=List[ProjectResponse])
-async def get_user_projects(user_id: str, db: AsyncSession = Depends(get_db)):
+async def get_user_projects(
+    user_id: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=PAGINATION_MAX_LIMIT),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    media_type = accepted_media_type(request)
     # Check if user exists
-    result = await db.execute(
-        text("SELECT * FROM users WHERE id = :id"),
-        {"id": user_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="User not found")
+    await require_user(db, user_id)
 
     # Get projects owned by user
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE user_id = :user_id ORDER BY updated_at DESC"),
-        {"user_id": user_id}
-    )
-    rows = result.fetchall()
-    projects = []
-    for row in rows:
-        # Get comment count
-        count_result = await db.execute(
-            text("SELECT COUNT(*) FROM comments WHERE project_id = :project_id"),
-            {"project_id": row.id}
-        )
-        count = count_result.scalar() or 0
-
-        # Get owner name
-        owner_result = await db.execute(
-            text("SELECT name FROM users WHERE id = :id"),
-            {"id": row.user_id}
-        )
-        owner_row = owner_result.fetchone()
-        owner_name = owner_row.name if owner_row else "Unknown"
-
-        projects.append(ProjectResponse(
-            id=row.id,
-            user_id=row.user_id,
-            title=row.title,
-            created_at=format_datetime(row.created_at),
-            updated_at=format_datetime(row.updated_at),
-            comment_count=count,
-            owner_name=owner_name
-        ))
-    return projects
+    rows = await fetch_page(db, USER_PROJECTS_SQL, {"user_id": user_id}, USER_PROJECTS_KEYSET, after, limit)
+    rows = next_page(rows, limit, response, lambda row: (row.updated_at, row.id))
+    return list_response(ProjectResponse, rows, media_type, response)
 
 
 @app.get("/users/{user_id}/shared-projects", response_model=List[ProjectResponse])
-async def get_shared_projects(user_id: str, db: AsyncSession = Depends(get_db)):
+async def get_shared_projects(
+    user_id: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=PAGINATION_MAX_LIMIT),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    media_type = accepted_media_type(request)
     # Check if user exists
-    result = await db.execute(
-        text("SELECT * FROM users WHERE id = :id"),
-        {"id": user_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="User not found")
+    await require_user(db, user_id)
 
     # Get projects shared with user
-    result = await db.execute(
-        text("""
-            SELECT p.*, ps.created_at as share_created_at
-            FROM projects p
-            JOIN project_shares ps ON p.id = ps.project_id
-            WHERE ps.shared_with_user_id = :user_id
-            ORDER BY ps.created_at DESC
-        """),
-        {"user_id": user_id}
-    )
-    rows = result.fetchall()
-    projects = []
-    for row in rows:
-        # Get comment count
-        count_result = await db.execute(
-            text("SELECT COUNT(*) FROM comments WHERE project_id = :project_id"),
-            {"project_id": row.id}
-        )
-        count = count_result.scalar() or 0
+    rows = await fetch_page(db, SHARED_PROJECTS_SQL, {"user_id": user_id}, SHARED_PROJECTS_KEYSET, after, limit)
+    rows = next_page(rows, limit, response, lambda row: (row.shared_at, row.id))
+    return list_response(ProjectResponse, rows, media_type, response)
+
+
+@app.get("/users/{user_id}/search", response_model=SearchResponse)
+async def search_comments(
+    user_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """Ranked full-text search over comments in the user's own and shared projects."""
+    # Check if user exists
+    await require_user(db, user_id)
 
-        # Get owner name
-        owner_result = await db.execute(
-            text("SELECT name FROM users WHERE id = :id"),
-            {"id": row.user_id}
-        )
-        owner_row = owner_result.fetchone()
-        owner_name = owner_row.name if owner_row else "Unknown"
+    result = await db.execute(text(ACCESSIBLE_PROJECTS_SQL), {"user_id": user_id})
+    project_ids = [row.id for row in result.fetchall()]
 
-        projects.append(ProjectResponse(
-            id=row.id,
-            user_id=row.user_id,
-            title=row.title,
-            created_at=format_datetime(row.created_at),
-            updated_at=format_datetime(row.updated_at),
-            comment_count=count,
-            owner_name=owner_name
-        ))
-    return projects
+    rows = await search.search_comments(db, q, project_ids, limit + 1, offset)
+    results = [
+        SearchResult(**dict(row_data(row), snippet=search.highlight(row.snippet)))
+        for row in rows[:limit]
+    ]
+    return SearchResponse(results=results, next_offset=offset + limit if len(rows) > limit else None)
 
 
 @app.get("/projects/{project_id}", response_model=ProjectResponse)
-async def get_project(project_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    row = result.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    # Get comment count
-    count_result = await db.execute(
-        text("SELECT COUNT(*) FROM comments WHERE project_id = :project_id"),
-        {"project_id": project_id}
-    )
-    count = count_result.scalar() or 0
-
-    # Get owner name
-    owner_result = await db.execute(
-        text("SELECT name FROM users WHERE id = :id"),
-        {"id": row.user_id}
-    )
-    owner_row = owner_result.fetchone()
-    owner_name = owner_row.name if owner_row else "Unknown"
-
-    return ProjectResponse(
-        id=row.id,
-        user_id=row.user_id,
-        title=row.title,
-        created_at=format_datetime(row.created_at),
-        updated_at=format_datetime(row.updated_at),
-        comment_count=count,
-        owner_name=owner_name
-    )
-
-
-@app.delete("/projects/{project_id}")
+async def get_project(project_id: str, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    revision = await project_revision(db, project_id)
+    not_modified = conditional_response(request, response, revision_etag("project", revision))
+    if not_modified:
+        return not_modified
+    return await fetch_project(db, project_id)
+
+
+async def rows_by_page(db: AsyncSession, sql: str, project_id: str) -> AsyncIterator[Tuple[str, list]]:
+    """(page_id, rows) for each page of a page-ordered query, read SNAPSHOT_BATCH_ROWS at a time."""
+    # Reads are shielded: a disconnect that cancelled one mid-query would make
+    # SQLAlchemy drop the connection instead of returning it to the pool
+    with anyio.CancelScope(shield=True):
+        result = await db.stream(text(sql), {"project_id": project_id})
+    page_id, rows = None, []
+    while True:
+        with anyio.CancelScope(shield=True):
+            partition = await result.fetchmany(SNAPSHOT_BATCH_ROWS)
+        if not partition:
+            break
+        for row in partition:
+            if row.page_id != page_id:
+                if rows:
+                    yield page_id, rows
+                page_id, rows = row.page_id, []
+            rows.append(row)
+    if rows:
+        yield page_id, rows
+
+
+async def page_map(groups: AsyncIterator[Tuple[str, list]], page_ids: List[str],
+                   encode: Callable[[str, list], bytes]) -> AsyncIterator[bytes]:
+    """A JSON object from page id to encode(page_id, rows), with a key for every page in page_ids."""
+    remaining = dict.fromkeys(page_ids)
+    separator = b""
+    yield b"{"
+    async for page_id, rows in groups:
+        # Rows of a deleted page stay until its cleanup job has run
+        if page_id not in remaining:
+            continue
+        del remaining[page_id]
+        yield separator + encoders.dumps(page_id) + b":" + encode(page_id, rows)
+        separator = b","
+    for page_id in remaining:
+        yield separator + encoders.dumps(page_id) + b":" + encode(page_id, [])
+        separator = b","
+    yield b"}"
+
+
+async def snapshot_body(db: AsyncSession, project: ProjectResponse, pages: list, strokes: list) -> AsyncIterator[bytes]:
+    page_ids = [page.id for page in pages]
+    strokes_by_page = {}
+    for row in strokes:
+        strokes_by_page.setdefault(row.page_id, []).append(row)
+    comments = encoders.encoder_for(CommentResponse)
+    lines = encoders.encoder_for(LineResponse)
+
+    yield (b'{"project":' + encoders.dumps(project.model_dump())
+           + b',"pages":' + encoders.dumps(encoders.encoder_for(SnapshotPage).objects(pages))
+           + b',"comments":')
+    async for chunk in page_map(rows_by_page(db, SNAPSHOT_COMMENTS_SQL, project.id), page_ids,
+                                lambda page_id, rows: encoders.dumps(comments.objects(rows))):
+        yield chunk
+    yield b',"lines":'
+    async for chunk in page_map(
+        rows_by_page(db, SNAPSHOT_LINES_SQL, project.id), page_ids,
+        lambda page_id, rows: encoders.dumps(lines.objects(with_stroke_segments(rows, strokes_by_page.get(page_id, []))))
+    ):
+        yield chunk
+    yield b"}"
+
+
+@app.get("/projects/{project_id}/snapshot", response_model=SnapshotResponse)
+async def get_project_snapshot(project_id: str, request: Request):
+    """
+    The project, its pages and every page's comments and lines in one
+    response, read with a fixed five queries and streamed as it is encoded.
+    """
+    # Not Depends(get_db): the session has to outlive this function while the body streams,
+    # so the response closes it
+    stack = AsyncExitStack()
+    db = await stack.enter_async_context(AsyncSessionLocal())
+    try:
+        result = await db.execute(text(PROJECT_SUMMARY_SELECT + " WHERE p.id = :id"), {"id": project_id})
+        project = result.fetchone()
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        result = await db.execute(text(PAGES_BY_PROJECT_SQL), {"project_id": project_id})
+        pages = result.fetchall()
+
+        # Page revisions only grow, and adding or removing a page bumps the project revision
+        etag = revision_etag(f"snapshot-{project.revision}", sum(page.revision for page in pages))
+        headers = dict(cache_headers(etag), Vary="Accept, Accept-Encoding")
+        if etag_matches(request, etag):
+            await stack.aclose()
+            return Response(status_code=304, headers=headers)
+
+        result = await db.execute(text(SNAPSHOT_STROKES_SQL), {"project_id": project_id})
+        strokes = result.fetchall()
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    body = snapshot_body(db, project_response(project), pages, strokes)
+    encoding = encoders.negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding:
+        body = encoders.compress_stream(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return ClosingStreamingResponse(body, stack, media_type="application/json", headers=headers)
+
+
+@app.delete("/projects/{project_id}", response_model=DeleteResponse)
 async def delete_project(project_id: str, db: AsyncSession = Depends(get_db)):
-    # Check if project exists
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Project not found")
+    # Delete project; its pages and annotations go in the background
+    await delete_returning(db, "projects", {"id": project_id}, "Project", returning="id")
 
     # Delete all shares
     await db.execute(
         text("DELETE FROM project_shares WHERE project_id = :id"),
         {"id": project_id}
     )
-
-    # Delete all comments
-    await db.execute(
-        text("DELETE FROM comments WHERE project_id = :id"),
-        {"id": project_id}
-    )
-
-    # Delete project
-    await db.execute(
-        text("DELETE FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
     await db.commit()
-    return {"deleted": True}
+    await row_cache.invalidate("project", project_id)
+    job = deletion_jobs.delete_project_rows(engine, project_id)
+    return DeleteResponse(deleted=True, job_id=job.id)
 
 
 @app.patch("/projects/{project_id}", response_model=ProjectResponse)
 async def update_project(project_id: str, update: ProjectUpdate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    row = result.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Project not found")
-
     update_data = update.model_dump(exclude_unset=True)
-    if update_data:
-        set_clause = ", ".join([f"{k} = :{k}" for k in update_data])
-        update_data["id"] = project_id
-        await db.execute(
-            text(f"UPDATE projects SET {set_clause} WHERE id = :id"),
-            update_data
-        )
-        await db.commit()
+    if not update_data:
+        return await fetch_project(db, project_id)
 
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    row = result.fetchone()
-
-    # Get comment count
-    count_result = await db.execute(
-        text("SELECT COUNT(*) FROM comments WHERE project_id = :project_id"),
-        {"project_id": project_id}
-    )
-    count = count_result.scalar() or 0
-
-    # Get owner name
-    owner_result = await db.execute(
-        text("SELECT name FROM users WHERE id = :id"),
-        {"id": row.user_id}
-    )
-    owner_row = owner_result.fetchone()
-    owner_name = owner_row.name if owner_row else "Unknown"
-
-    return ProjectResponse(
-        id=row.id,
-        user_id=row.user_id,
-        title=row.title,
-        created_at=format_datetime(row.created_at),
-        updated_at=format_datetime(row.updated_at),
-        comment_count=count,
-        owner_name=owner_name
-    )
+    try:
+        row = await update_returning(
+            db, "projects", {"id": project_id}, update_data, "Project",
+            extra_set="revision = revision + 1", returning=PROJECT_RETURNING
+        )
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="A project with this title already exists")
+    await db.commit()
+    await row_cache.invalidate("project", project_id)
+    return project_response(row)
 
 
 # Share endpoints
@@ -500,16 +1179,11 @@ async def update_project(project_id: str, update: ProjectUpdate, db: AsyncSessio
 @app.post("/projects/{project_id}/share", response_model=ShareResponse)
 async def share_project(project_id: str, request: ShareRequest, db: AsyncSession = Depends(get_db)):
     # Check if project exists
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Project not found")
+    await require_project(db, project_id)
 
     # Find user to share with
     result = await db.execute(
-        text("SELECT * FROM users WHERE name = :name"),
+        text(USER_BY_NAME_SQL),
         {"name": request.username}
     )
     target_user = result.fetchone()
@@ -520,206 +1194,380 @@ async def share_project(project_id: str, request: ShareRequest, db: AsyncSession
 
     # Check if already shared
     result = await db.execute(
-        text("SELECT * FROM project_shares WHERE project_id = :project_id AND shared_with_user_id = :user_id"),
+        text(SHARE_LOOKUP_SQL),
         {"project_id": project_id, "user_id": target_user_id}
     )
     if result.fetchone():
         raise HTTPException(status_code=400, detail="Project already shared with this user")
 
-    db_share = ProjectShare(
-        id=str(uuid.uuid4()),
-        project_id=project_id,
-        shared_with_user_id=target_user_id,
-        created_at=datetime.utcnow()
-    )
-    db.add(db_share)
+    # The cached check above may predate another worker's delete; the insert checks again
+    params = {"id": str(uuid.uuid4()), "project_id": project_id, "user_id": target_user_id, "now": datetime.utcnow()}
+    result = await db.execute(text(SHARE_INSERT_SQL), params)
+    if result.rowcount == 0:
+        await row_cache.invalidate("project", project_id)
+        raise HTTPException(status_code=404, detail="Project not found")
     await db.commit()
-    await db.refresh(db_share)
-
     return ShareResponse(
-        id=db_share.id,
-        project_id=db_share.project_id,
-        shared_with_user_id=db_share.shared_with_user_id,
-        created_at=format_datetime(db_share.created_at)
+        id=params["id"],
+        project_id=project_id,
+        shared_with_user_id=target_user_id,
+        created_at=format_datetime(params["now"])
     )
 
 
 # Page endpoints
 
 @app.get("/projects/{project_id}/pages", response_model=List[PageResponse])
-async def get_pages(project_id: str, db: AsyncSession = Depends(get_db)):
-    # Check if project exists
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Project not found")
+async def get_pages(project_id: str, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    media_type = accepted_media_type(request)
+    # Also checks that the project exists
+    revision = await project_revision(db, project_id)
+    not_modified = conditional_response(request, response, revision_etag("pages", revision, media_type))
+    if not_modified:
+        return not_modified
 
     result = await db.execute(
-        text("SELECT * FROM pages WHERE project_id = :project_id ORDER BY `order` ASC"),
+        text(PAGES_BY_PROJECT_SQL),
         {"project_id": project_id}
     )
-    rows = result.fetchall()
-    return [PageResponse(**row._mapping) for row in rows]
+    return list_response(PageResponse, result.fetchall(), media_type, response)
 
 
 @app.get("/projects/{project_id}/pages/{page_id}", response_model=PageResponse)
 async def get_page(project_id: str, page_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM pages WHERE id = :id AND project_id = :project_id"),
-        {"id": page_id, "project_id": project_id}
-    )
-    row = result.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Page not found")
-    return PageResponse(**row._mapping)
+    return PageResponse(**await require_page(db, project_id, page_id))
 
 
 @app.post("/projects/{project_id}/pages", response_model=PageResponse)
 async def create_page(project_id: str, page: PageCreate, db: AsyncSession = Depends(get_db)):
-    # Check if project exists
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    # Get the next order number
-    result = await db.execute(
-        text("SELECT COALESCE(MAX(`order`), -1) + 1 as next_order FROM pages WHERE project_id = :project_id"),
-        {"project_id": project_id}
-    )
-    next_order = result.fetchone().next_order
-
     # Normalize URL
     url = page.url
     if not url.startswith('http://') and not url.startswith('https://'):
         url = 'https://' + url
 
-    page_id = str(uuid.uuid4())
-    page_title = page.title or f"Page {next_order + 1}"
-    now = datetime.utcnow()
-
-    # Insert using text() to avoid async issues
-    await db.execute(
-        text("INSERT INTO pages (id, project_id, url, title, `order`, created_at) VALUES (:id, :project_id, :url, :title, :order, :created_at)"),
-        {"id": page_id, "project_id": project_id, "url": url, "title": page_title, "order": next_order, "created_at": now}
+    result = await db.execute(
+        text(PAGE_INSERT_SQL),
+        {"id": str(uuid.uuid4()), "project_id": project_id, "url": url, "title": page.title,
+         "now": datetime.utcnow()}
     )
-    await db.commit()
+    row = result.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Project not found")
 
-    # Update project timestamp
-    await db.execute(
-        text("UPDATE projects SET updated_at = :now WHERE id = :id"),
-        {"id": project_id, "now": now}
-    )
+    # Update project timestamp and page count in the same transaction
+    await bump_project(db, project_id, page_count=1)
     await db.commit()
-
-    return PageResponse(
-        id=page_id,
-        project_id=project_id,
-        url=url,
-        title=page_title,
-        order=next_order,
-        created_at=format_datetime(now)
-    )
+    return PageResponse(**row_data(row))
 
 
 @app.patch("/projects/{project_id}/pages/{page_id}", response_model=PageResponse)
 async def update_page(project_id: str, page_id: str, update: PageUpdate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM pages WHERE id = :id AND project_id = :project_id"),
-        {"id": page_id, "project_id": project_id}
-    )
-    row = result.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Page not found")
-
     update_data = update.model_dump(exclude_unset=True)
+    # Normalize URL if provided
+    if 'url' in update_data:
+        url = update_data['url']
+        if url and not url.startswith('http://') and not url.startswith('https://'):
+            update_data['url'] = 'https://' + url
+
+    row = await update_returning(db, "pages", {"id": page_id, "project_id": project_id}, update_data, "Page")
     if update_data:
-        # Normalize URL if provided
-        if 'url' in update_data:
-            url = update_data['url']
-            if url and not url.startswith('http://') and not url.startswith('https://'):
-                update_data['url'] = 'https://' + url
-
-        set_clause = ", ".join([f"{k} = :{k}" for k in update_data])
-        update_data["id"] = page_id
-        await db.execute(
-            text(f"UPDATE pages SET {set_clause} WHERE id = :id"),
-            update_data
-        )
+        # The page list is cached against the project revision
+        await bump_project(db, project_id, touch=False)
         await db.commit()
+        await row_cache.invalidate("page", page_id)
+    return PageResponse(**row_data(row))
+
 
+@app.delete("/projects/{project_id}/pages/{page_id}", response_model=DeleteResponse)
+async def delete_page(project_id: str, page_id: str, db: AsyncSession = Depends(get_db)):
+    # Take the page's annotations off the counters now; the rows go in the background
     result = await db.execute(
-        text("SELECT * FROM pages WHERE id = :id"),
-        {"id": page_id}
+        text(PAGE_ANNOTATION_COUNTS_SQL),
+        {"project_id": project_id, "page_id": page_id}
     )
-    row = result.fetchone()
-    return PageResponse(**row._mapping)
+    counts = result.one()
+
+    # Delete the page
+    await delete_returning(db, "pages", {"id": page_id, "project_id": project_id}, "Page", returning="id")
+    await bump_project(
+        db, project_id, touch=False,
+        page_count=-1,
+        comment_count=-counts.comments,
+        open_comment_count=-counts.open_comments,
+        line_count=-(counts.lines + counts.strokes),
+    )
+    await db.commit()
+    await row_cache.invalidate("page", page_id)
+    viewport_cache.discard(page_id)
+    job = deletion_jobs.delete_page_rows(engine, project_id, page_id)
+    return DeleteResponse(deleted=True, job_id=job.id)
 
 
-@app.delete("/projects/{project_id}/pages/{page_id}")
-async def delete_page(project_id: str, page_id: str, db: AsyncSession = Depends(get_db)):
+@app.get("/jobs/{job_id}", response_model=DeletionJobResponse)
+async def get_job(job_id: str):
+    """Progress of a background cascade deletion started by this worker."""
+    job = deletion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return DeletionJobResponse(**job.as_dict())
+
+
+# Incremental sync
+
+@app.get("/projects/{project_id}/pages/{page_id}/changes", response_model=PageChangesResponse)
+async def get_page_changes(project_id: str, page_id: str, since: int = 0, db: AsyncSession = Depends(get_db)):
+    """
+    Comments and lines changed on a page after revision `since`.
+
+    Pass the returned revision as `since` on the next call. Rows come back
+    in their current state; deletions are listed by id.
+    """
+    # Read the revision first: anything committed after this point is
+    # returned again next time rather than skipped
     result = await db.execute(
-        text("SELECT * FROM pages WHERE id = :id AND project_id = :project_id"),
+        text("SELECT revision FROM pages WHERE id = :id AND project_id = :project_id"),
         {"id": page_id, "project_id": project_id}
     )
-    if not result.fetchone():
+    revision = result.scalar()
+    if revision is None:
         raise HTTPException(status_code=404, detail="Page not found")
 
-    # Delete all comments for this page
-    await db.execute(
-        text("DELETE FROM comments WHERE project_id = :project_id AND page_id = :page_id"),
-        {"project_id": project_id, "page_id": page_id}
+    params = {"project_id": project_id, "page_id": page_id, "since": since}
+    comments = (await db.execute(text(COMMENTS_SINCE_SQL), params)).fetchall()
+    lines = (await db.execute(text(LINES_SINCE_SQL), params)).fetchall()
+    strokes = (await db.execute(text(STROKES_SINCE_SQL), params)).fetchall()
+    tombstones = (await db.execute(text(TOMBSTONES_SINCE_SQL), params)).fetchall()
+
+    return PageChangesResponse(
+        revision=revision,
+        comments=[CommentResponse(**row_data(row)) for row in comments],
+        lines=[LineResponse(**row_data(row)) for row in lines],
+        strokes=[stroke_response(row) for row in strokes],
+        deleted_comments=[row.entity_id for row in tombstones if row.kind == "comment"],
+        deleted_lines=[row.entity_id for row in tombstones if row.kind == "line"],
+        deleted_strokes=[row.entity_id for row in tombstones if row.kind == "stroke"],
     )
 
-    # Delete all lines for this page
-    await db.execute(
-        text("DELETE FROM lines WHERE project_id = :project_id AND page_id = :page_id"),
-        {"project_id": project_id, "page_id": page_id}
+
+# Viewport queries
+
+def viewport_box(x_min: Optional[float], y_min: Optional[float],
+                 x_max: Optional[float], y_max: Optional[float]) -> Optional[Box]:
+    """The requested viewport, open-ended on any side left out; None if no bounds were given."""
+    if x_min is None and y_min is None and x_max is None and y_max is None:
+        return None
+    return (
+        -math.inf if x_min is None else x_min,
+        -math.inf if y_min is None else y_min,
+        math.inf if x_max is None else x_max,
+        math.inf if y_max is None else y_max,
     )
 
-    # Delete the page
-    await db.execute(
-        text("DELETE FROM pages WHERE id = :id"),
-        {"id": page_id}
+
+def index_comment(page: PageAnnotations, row):
+    comment = CommentResponse(**row_data(row))
+    page.comments.put(comment.id, [((comment.x, comment.y, comment.x, comment.y), ((row.created_at, row.id), comment))])
+
+
+def index_line(page: PageAnnotations, row):
+    line = LineResponse(**row_data(row))
+    page.lines.put(line.id, [(segment_box(line.x1, line.y1, line.x2, line.y2), ((line.created_at, 0), line))])
+
+
+def index_stroke(page: PageAnnotations, row):
+    page.lines.put(row.id, [
+        (segment_box(segment.x1, segment.y1, segment.x2, segment.y2), ((segment.created_at, i), segment))
+        for i, segment in enumerate(stroke_segments(row))
+    ])
+
+
+async def page_annotations(db: AsyncSession, project_id: str, page_id: str,
+                           revision: Optional[int]) -> Optional[PageAnnotations]:
+    """
+    The page's spatial index, brought up to date with the database at
+    `revision` (from page_revision).
+
+    A cached index at an older revision is patched from the changes feed;
+    only a page this worker has not seen is read in full.
+    """
+    if revision is None:
+        viewport_cache.discard(page_id)
+        return None
+
+    page = viewport_cache.get(page_id)
+    if page is not None and page.revision == revision:
+        viewport_cache.hits += 1
+        return page
+
+    params = {"project_id": project_id, "page_id": page_id}
+    if page is None or page.revision > revision:
+        page = PageAnnotations(revision)
+        comments = (await db.execute(text(COMMENTS_BY_PAGE_SQL), params)).fetchall()
+        lines = (await db.execute(text(LINES_BY_PAGE_SQL), params)).fetchall()
+        strokes = (await db.execute(text(STROKES_BY_PAGE_SQL), params)).fetchall()
+        viewport_cache.builds += 1
+    else:
+        params["since"] = page.revision
+        comments = (await db.execute(text(COMMENTS_SINCE_SQL), params)).fetchall()
+        lines = (await db.execute(text(LINES_SINCE_SQL), params)).fetchall()
+        strokes = (await db.execute(text(STROKES_SINCE_SQL), params)).fetchall()
+        tombstones = (await db.execute(text(TOMBSTONES_SINCE_SQL), params)).fetchall()
+        for row in tombstones:
+            (page.comments if row.kind == "comment" else page.lines).remove(row.entity_id)
+        viewport_cache.updates += 1
+
+    for row in comments:
+        index_comment(page, row)
+    for row in lines:
+        index_line(page, row)
+    for row in strokes:
+        index_stroke(page, row)
+    page.revision = revision
+    viewport_cache.put(page_id, page)
+    return page
+
+
+# Live annotation stream
+
+@app.websocket("/projects/{project_id}/pages/{page_id}/stream")
+async def page_stream_ws(websocket: WebSocket, project_id: str, page_id: str):
+    """Push comment and line changes on a page to connected reviewers."""
+    await websocket.accept()
+    subscription = hub.subscribe(page_channel(project_id, page_id))
+    # The client never sends anything we need; this only notices disconnects
+    receiver = asyncio.create_task(websocket.receive())
+    try:
+        while True:
+            getter = asyncio.create_task(subscription.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                message = receiver.result()
+                if message["type"] == "websocket.disconnect":
+                    break
+                receiver = asyncio.create_task(websocket.receive())
+                continue
+            message = getter.result()
+            if message is None:
+                # Fell too far behind; the client should reload and reconnect
+                await websocket.close(code=1013)
+                break
+            await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        hub.unsubscribe(subscription)
+
+
+@app.get("/projects/{project_id}/pages/{page_id}/stream")
+async def page_stream_sse(project_id: str, page_id: str, request: Request):
+    """Server-sent events fallback for clients that cannot use WebSockets."""
+    subscription = hub.subscribe(page_channel(project_id, page_id))
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                message = await subscription.get(timeout=REALTIME_KEEPALIVE)
+                if message is None:
+                    yield "event: overflow\ndata: {}\n\n"
+                    break
+                if message == "":
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
     )
-    await db.commit()
-    return {"deleted": True}
 
 
 # Comment endpoints
 
 @app.get("/projects/{project_id}/pages/{page_id}/comments", response_model=List[CommentResponse])
-async def get_comments(project_id: str, page_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM comments WHERE project_id = :project_id AND page_id = :page_id ORDER BY created_at DESC"),
-        {"project_id": project_id, "page_id": page_id}
-    )
-    rows = result.fetchall()
-    return [CommentResponse(**row._mapping) for row in rows]
+async def get_comments(
+    project_id: str,
+    page_id: str,
+    request: Request,
+    response: Response,
+    x_min: Optional[float] = None,
+    y_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_max: Optional[float] = None,
+    resolved: Optional[bool] = None,
+    author: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PAGINATION_MAX_LIMIT),
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    media_type = accepted_media_type(request)
+    revision = await page_revision(db, project_id, page_id)
+    if revision is None:
+        # The page's rows may outlive it until its cleanup job has run
+        raise HTTPException(status_code=404, detail="Page not found")
+    not_modified = conditional_response(request, response, revision_etag("comments", revision, media_type))
+    if not_modified:
+        return not_modified
+
+    if created_after is not None:
+        created_after = utc_naive(created_after)
+    if created_before is not None:
+        created_before = utc_naive(created_before)
+    viewport = viewport_box(x_min, y_min, x_max, y_max)
+    if viewport is not None:
+        page = await page_annotations(db, project_id, page_id, revision)
+        if page is None:
+            return list_response(CommentResponse, [], media_type, response)
+        # Same filters and keyset as the SQL path, applied to the indexed rows
+        matches = sorted(page.comments.query(viewport), key=lambda item: item[0], reverse=True)
+        cursor = decode_cursor(after) if after else None
+        comments = []
+        for (created_at, comment_id), comment in matches:
+            created = datetime.fromisoformat(format_datetime(created_at))
+            if ((resolved is not None and comment.resolved != resolved)
+                    or (author is not None and comment.author != author)
+                    or (created_after is not None and created < created_after)
+                    or (created_before is not None and created >= created_before)
+                    or (cursor is not None and (created, comment_id) >= cursor)):
+                continue
+            comments.append(comment)
+            if limit and len(comments) > limit:
+                break
+        comments = next_page(comments, limit, response, lambda comment: (comment.created_at, comment.id))
+        return list_response(CommentResponse, comments, media_type, response)
+
+    sql = COMMENTS_BY_PAGE_SQL
+    params = {"project_id": project_id, "page_id": page_id}
+    if resolved is not None:
+        sql += " AND resolved = :resolved"
+        params["resolved"] = resolved
+    if author is not None:
+        sql += " AND author = :author"
+        params["author"] = author
+    if created_after is not None:
+        sql += " AND created_at >= :created_after"
+        params["created_after"] = created_after
+    if created_before is not None:
+        sql += " AND created_at < :created_before"
+        params["created_before"] = created_before
+
+    rows = await fetch_page(db, sql, params, COMMENTS_KEYSET, after, limit)
+    rows = next_page(rows, limit, response, lambda row: (row.created_at, row.id))
+    return list_response(CommentResponse, rows, media_type, response)
 
 
 @app.post("/projects/{project_id}/comments", response_model=CommentResponse)
 async def create_comment(project_id: str, comment: CommentCreate, db: AsyncSession = Depends(get_db)):
-    # Check if project exists
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    # Check if page exists and belongs to project
-    result = await db.execute(
-        text("SELECT * FROM pages WHERE id = :id AND project_id = :project_id"),
-        {"id": comment.page_id, "project_id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Page not found")
+    # Check that the project exists and the page belongs to it
+    await require_page(db, project_id, comment.page_id)
 
+    now = datetime.utcnow()
     db_comment = Comment(
         id=str(uuid.uuid4()),
         project_id=project_id,
@@ -729,19 +1577,17 @@ async def create_comment(project_id: str, comment: CommentCreate, db: AsyncSessi
         text=comment.text,
         author=comment.author,
         resolved=False,
-        created_at=datetime.utcnow()
+        created_at=now,
+        updated_at=now,
+        revision=await next_page_revision(db, project_id, comment.page_id)
     )
     db.add(db_comment)
 
-    # Update project timestamp
-    await db.execute(
-        text("UPDATE projects SET updated_at = :now WHERE id = :id"),
-        {"id": project_id, "now": datetime.utcnow()}
-    )
+    # Update project timestamp and counters
+    await bump_project(db, project_id, comment_count=1, open_comment_count=1)
 
-    await db.commit()
-    await db.refresh(db_comment)
-    return CommentResponse(
+    # Built before the commit, which would expire the instance
+    response = CommentResponse(
         id=db_comment.id,
         project_id=db_comment.project_id,
         page_id=db_comment.page_id,
@@ -750,85 +1596,97 @@ async def create_comment(project_id: str, comment: CommentCreate, db: AsyncSessi
         text=db_comment.text,
         author=db_comment.author,
         resolved=db_comment.resolved,
-        created_at=format_datetime(db_comment.created_at)
+        created_at=format_datetime(db_comment.created_at),
+        updated_at=format_datetime(db_comment.updated_at),
+        revision=db_comment.revision
     )
+    await db.commit()
+    await hub.publish(project_id, response.page_id, "comment.created", response.model_dump())
+    return response
 
 
 @app.patch("/comments/{comment_id}", response_model=CommentResponse)
 async def update_comment(comment_id: str, update: CommentUpdate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM comments WHERE id = :id"),
-        {"id": comment_id}
-    )
-    row = result.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Comment not found")
-
     update_data = update.model_dump(exclude_unset=True)
-    if update_data:
-        set_clause = ", ".join([f"{k} = :{k}" for k in update_data])
-        update_data["id"] = comment_id
+    if not update_data:
+        row = await row_or_404(db, "comments", {"id": comment_id}, "Comment", returning=COMMENT_COLUMNS)
+        return CommentResponse(**row_data(row))
+
+    update_data["updated_at"] = datetime.utcnow()
+    update_data["revision"] = await claim_page_revision(db, "comments", comment_id, "Comment")
+    resolved = update_data.get("resolved")
+    if resolved is not None:
         await db.execute(
-            text(f"UPDATE comments SET {set_clause} WHERE id = :id"),
-            update_data
+            text(COMMENT_RESOLVED_COUNTER_SQL),
+            {"id": comment_id, "resolved": resolved, "delta": -1 if resolved else 1}
         )
-        await db.commit()
-
-    result = await db.execute(
-        text("SELECT * FROM comments WHERE id = :id"),
-        {"id": comment_id}
-    )
-    row = result.fetchone()
-    return CommentResponse(**row._mapping)
+    row = await update_returning(db, "comments", {"id": comment_id}, update_data, "Comment",
+                                 returning=COMMENT_COLUMNS)
+    await db.commit()
+    response = CommentResponse(**row_data(row))
+    await hub.publish(response.project_id, response.page_id, "comment.updated", response.model_dump())
+    return response
 
 
 @app.delete("/comments/{comment_id}")
 async def delete_comment(comment_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM comments WHERE id = :id"),
-        {"id": comment_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Comment not found")
-
-    await db.execute(
-        text("DELETE FROM comments WHERE id = :id"),
-        {"id": comment_id}
+    row = await delete_returning(db, "comments", {"id": comment_id}, "Comment",
+                                 returning="id, project_id, page_id, resolved")
+    revision = await add_tombstone(db, "comment", row)
+    await bump_project(
+        db, row.project_id, touch=False,
+        comment_count=-1,
+        open_comment_count=0 if row.resolved else -1,
     )
     await db.commit()
+    await hub.publish(row.project_id, row.page_id, "comment.deleted", {"id": comment_id, "revision": revision})
     return {"deleted": True}
 
 
 # Line endpoints
 
 @app.get("/projects/{project_id}/pages/{page_id}/lines", response_model=List[LineResponse])
-async def get_lines(project_id: str, page_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM lines WHERE project_id = :project_id AND page_id = :page_id ORDER BY created_at ASC"),
-        {"project_id": project_id, "page_id": page_id}
-    )
-    rows = result.fetchall()
-    return [LineResponse(**row._mapping) for row in rows]
+async def get_lines(
+    project_id: str,
+    page_id: str,
+    request: Request,
+    response: Response,
+    x_min: Optional[float] = None,
+    y_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_max: Optional[float] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    media_type = accepted_media_type(request)
+    revision = await page_revision(db, project_id, page_id)
+    if revision is None:
+        # The page's rows may outlive it until its cleanup job has run
+        raise HTTPException(status_code=404, detail="Page not found")
+    not_modified = conditional_response(request, response, revision_etag("lines", revision, media_type))
+    if not_modified:
+        return not_modified
+
+    viewport = viewport_box(x_min, y_min, x_max, y_max)
+    if viewport is not None:
+        # Lines (and stroke segments) match when their bounding box meets the viewport
+        page = await page_annotations(db, project_id, page_id, revision)
+        if page is None:
+            return list_response(LineResponse, [], media_type, response)
+        matches = sorted(page.lines.query(viewport), key=lambda item: item[0])
+        return list_response(LineResponse, [line for _, line in matches], media_type, response)
+
+    params = {"project_id": project_id, "page_id": page_id}
+    lines = (await db.execute(text(LINES_BY_PAGE_SQL), params)).fetchall()
+    strokes = (await db.execute(text(STROKES_BY_PAGE_SQL), params)).fetchall()
+    return list_response(LineResponse, with_stroke_segments(lines, strokes), media_type, response)
 
 
 @app.post("/projects/{project_id}/lines", response_model=LineResponse)
 async def create_line(project_id: str, line: LineCreate, db: AsyncSession = Depends(get_db)):
-    # Check if project exists
-    result = await db.execute(
-        text("SELECT * FROM projects WHERE id = :id"),
-        {"id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    # Check if page exists and belongs to project
-    result = await db.execute(
-        text("SELECT * FROM pages WHERE id = :id AND project_id = :project_id"),
-        {"id": line.page_id, "project_id": project_id}
-    )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Page not found")
+    # Check that the project exists and the page belongs to it
+    await require_page(db, project_id, line.page_id)
 
+    now = datetime.utcnow()
     db_line = Line(
         id=str(uuid.uuid4()),
         project_id=project_id,
@@ -839,12 +1697,14 @@ async def create_line(project_id: str, line: LineCreate, db: AsyncSession = Depe
         y2=line.y2,
         color=line.color,
         author=line.author,
-        created_at=datetime.utcnow()
+        created_at=now,
+        updated_at=now,
+        revision=await next_page_revision(db, project_id, line.page_id)
     )
     db.add(db_line)
-    await db.commit()
-    await db.refresh(db_line)
-    return LineResponse(
+    await bump_project(db, project_id, touch=False, line_count=1)
+    # Built before the commit, which would expire the instance
+    response = LineResponse(
         id=db_line.id,
         project_id=db_line.project_id,
         page_id=db_line.page_id,
@@ -854,50 +1714,325 @@ async def create_line(project_id: str, line: LineCreate, db: AsyncSession = Depe
         y2=db_line.y2,
         color=db_line.color,
         author=db_line.author,
-        created_at=format_datetime(db_line.created_at)
+        created_at=format_datetime(db_line.created_at),
+        updated_at=format_datetime(db_line.updated_at),
+        revision=db_line.revision
     )
+    await db.commit()
+    await hub.publish(project_id, response.page_id, "line.created", response.model_dump())
+    return response
 
 
 @app.patch("/lines/{line_id}", response_model=LineResponse)
 async def update_line(line_id: str, update: LineUpdate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM lines WHERE id = :id"),
-        {"id": line_id}
-    )
-    row = result.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Line not found")
-
     update_data = update.model_dump(exclude_unset=True)
-    if update_data:
-        set_clause = ", ".join([f"{k} = :{k}" for k in update_data])
-        update_data["id"] = line_id
-        await db.execute(
-            text(f"UPDATE lines SET {set_clause} WHERE id = :id"),
-            update_data
-        )
-        await db.commit()
+    if not update_data:
+        row = await row_or_404(db, "lines", {"id": line_id}, "Line")
+        return LineResponse(**row_data(row))
 
-    result = await db.execute(
-        text("SELECT * FROM lines WHERE id = :id"),
-        {"id": line_id}
-    )
-    row = result.fetchone()
-    return LineResponse(**row._mapping)
+    update_data["updated_at"] = datetime.utcnow()
+    update_data["revision"] = await claim_page_revision(db, "lines", line_id, "Line")
+    row = await update_returning(db, "lines", {"id": line_id}, update_data, "Line")
+    await db.commit()
+    response = LineResponse(**row_data(row))
+    await hub.publish(response.project_id, response.page_id, "line.updated", response.model_dump())
+    return response
 
 
 @app.delete("/lines/{line_id}")
 async def delete_line(line_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        text("SELECT * FROM lines WHERE id = :id"),
-        {"id": line_id}
+    if STROKE_SEGMENT_SEPARATOR in line_id:
+        # A segment id from the get_lines view; erasing a segment erases its stroke
+        return await delete_stroke(line_id.split(STROKE_SEGMENT_SEPARATOR)[0], db)
+
+    row = await delete_returning(db, "lines", {"id": line_id}, "Line", returning="id, project_id, page_id")
+    revision = await add_tombstone(db, "line", row)
+    await bump_project(db, row.project_id, touch=False, line_count=-1)
+    await db.commit()
+    await hub.publish(row.project_id, row.page_id, "line.deleted", {"id": line_id, "revision": revision})
+    return {"deleted": True}
+
+
+# Stroke endpoints
+
+# Segment ids in the get_lines view are "<stroke id>:<segment index>"
+STROKE_SEGMENT_SEPARATOR = ":"
+
+
+def stroke_response(row) -> StrokeResponse:
+    data = row_data(row)
+    data["points"] = polyline.flatten(polyline.unpack(row.points, row.encoding))
+    return StrokeResponse(**data)
+
+
+def stroke_segments(row) -> List[LineResponse]:
+    """Expand a stroke into the per-segment rows older clients read from get_lines."""
+    data = row_data(row)
+    points = polyline.unpack(row.points, row.encoding)
+    return [
+        LineResponse(
+            id=f"{row.id}{STROKE_SEGMENT_SEPARATOR}{i}",
+            project_id=row.project_id,
+            page_id=row.page_id,
+            x1=start[0],
+            y1=start[1],
+            x2=end[0],
+            y2=end[1],
+            color=row.color,
+            author=row.author,
+            created_at=data["created_at"],
+            updated_at=data["updated_at"],
+            revision=row.revision
+        )
+        for i, (start, end) in enumerate(zip(points, points[1:]))
+    ]
+
+
+def with_stroke_segments(lines: list, strokes: list) -> list:
+    """
+    Both lists are in created_at order; interleave them so strokes show up
+    as their segments where a per-segment client would expect them.
+    """
+    if not strokes:
+        return lines
+    merged = heapq.merge(
+        ((row.created_at, [row]) for row in lines),
+        ((row.created_at, stroke_segments(row)) for row in strokes),
+        key=lambda item: item[0],
     )
-    if not result.fetchone():
-        raise HTTPException(status_code=404, detail="Line not found")
+    return [line for _, segments in merged for line in segments]
 
-    await db.execute(
-        text("DELETE FROM lines WHERE id = :id"),
-        {"id": line_id}
+
+@app.get("/projects/{project_id}/pages/{page_id}/strokes", response_model=List[StrokeResponse])
+async def get_strokes(project_id: str, page_id: str, db: AsyncSession = Depends(get_db)):
+    if await page_revision(db, project_id, page_id) is None:
+        raise HTTPException(status_code=404, detail="Page not found")
+    result = await db.execute(
+        text(STROKES_BY_PAGE_SQL),
+        {"project_id": project_id, "page_id": page_id}
     )
+    return [stroke_response(row) for row in result.fetchall()]
+
+
+@app.post("/projects/{project_id}/strokes", response_model=StrokeResponse)
+async def create_stroke(project_id: str, stroke: StrokeCreate, db: AsyncSession = Depends(get_db)):
+    if len(stroke.points) < 4 or len(stroke.points) % 2:
+        raise HTTPException(status_code=422, detail="A stroke needs at least two x,y points")
+
+    # Check that the project exists and the page belongs to it
+    await require_page(db, project_id, stroke.page_id)
+
+    tolerance = STROKE_SIMPLIFY_TOLERANCE if stroke.tolerance is None else stroke.tolerance
+    points = polyline.simplify(polyline.pairs(stroke.points), tolerance)
+    packed = polyline.pack(points, STROKE_STORAGE_ENCODING)
+    min_x, min_y, max_x, max_y = polyline.bounding_box(points)
+    now = datetime.utcnow()
+    params = {
+        "id": str(uuid.uuid4()), "project_id": project_id, "page_id": stroke.page_id,
+        "points": packed, "encoding": STROKE_STORAGE_ENCODING, "point_count": len(points),
+        "min_x": min_x, "min_y": min_y, "max_x": max_x, "max_y": max_y,
+        "color": stroke.color, "author": stroke.author,
+        "created_at": now, "updated_at": now,
+        "revision": await next_page_revision(db, project_id, stroke.page_id),
+    }
+    await db.execute(text(insert_sql("strokes", params)), params)
+    # A stroke counts as one line on the project
+    await bump_project(db, project_id, touch=False, line_count=1)
     await db.commit()
+
+    response = StrokeResponse(
+        id=params["id"],
+        project_id=project_id,
+        page_id=stroke.page_id,
+        # What was stored, after simplification and quantization
+        points=polyline.flatten(polyline.unpack(packed, STROKE_STORAGE_ENCODING)),
+        color=stroke.color,
+        author=stroke.author,
+        created_at=format_datetime(now),
+        updated_at=format_datetime(now),
+        revision=params["revision"]
+    )
+    await hub.publish(project_id, stroke.page_id, "stroke.created", response.model_dump())
+    return response
+
+
+@app.delete("/strokes/{stroke_id}")
+async def delete_stroke(stroke_id: str, db: AsyncSession = Depends(get_db)):
+    row = await delete_returning(db, "strokes", {"id": stroke_id}, "Stroke", returning="id, project_id, page_id")
+    revision = await add_tombstone(db, "stroke", row)
+    await bump_project(db, row.project_id, touch=False, line_count=-1)
+    await db.commit()
+    await hub.publish(row.project_id, row.page_id, "stroke.deleted", {"id": stroke_id, "revision": revision})
     return {"deleted": True}
+
+
+# Batch endpoint
+
+
+async def rows_by_id(db: AsyncSession, table: str, project_id: str, ids: List[str], columns: str = "*") -> dict:
+    if not ids:
+        return {}
+    result = await db.execute(
+        text(f"SELECT {columns} FROM {table} WHERE project_id = :project_id AND id IN :ids")
+        .bindparams(bindparam("ids", expanding=True)),
+        {"project_id": project_id, "ids": ids}
+    )
+    return {row.id: row for row in result.fetchall()}
+
+
+async def apply_batch_updates(db: AsyncSession, table: str, updates, rows: dict,
+                              revisions: dict, now: datetime) -> List[dict]:
+    """Run the updates as one executemany per set of changed columns; return the updated rows."""
+    groups = {}
+    updated = []
+    for update in updates:
+        row = rows[update.id]
+        data = update.model_dump(exclude_unset=True, exclude={"id"})
+        data["updated_at"] = now
+        data["revision"] = revisions[row.page_id]
+        groups.setdefault(tuple(data), []).append(dict(data, id=update.id))
+        merged = dict(row_data(row), **data)
+        merged["updated_at"] = format_datetime(now)
+        updated.append(merged)
+
+    for columns, params in groups.items():
+        await db.execute(
+            text(f"UPDATE {table} SET {build_set_clause(dict.fromkeys(columns))} WHERE id = :id"),
+            params
+        )
+    return updated
+
+
+@app.post("/projects/{project_id}/batch", response_model=BatchResponse)
+async def batch_mutations(project_id: str, batch: BatchRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Apply comment and line creates, updates and deletes in one transaction.
+
+    The project and pages are checked once for the whole batch, and each
+    kind of write is sent as a single executemany, so a drawing session of
+    hundreds of strokes costs a handful of statements and one commit.
+    """
+    operations = [batch.create_comments, batch.update_comments, batch.delete_comments,
+                  batch.create_lines, batch.update_lines, batch.delete_lines]
+    if sum(len(ops) for ops in operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_OPERATIONS} operations")
+
+    updated_comment_ids = [u.id for u in batch.update_comments]
+    updated_line_ids = [u.id for u in batch.update_lines]
+    if set(updated_comment_ids) & set(batch.delete_comments) or set(updated_line_ids) & set(batch.delete_lines):
+        raise HTTPException(status_code=422, detail="An annotation cannot be both updated and deleted in one batch")
+
+    await require_project(db, project_id)
+
+    new_page_ids = {c.page_id for c in batch.create_comments} | {l.page_id for l in batch.create_lines}
+    if new_page_ids:
+        result = await db.execute(
+            text("SELECT id FROM pages WHERE project_id = :project_id AND id IN :ids")
+            .bindparams(bindparam("ids", expanding=True)),
+            {"project_id": project_id, "ids": list(new_page_ids)}
+        )
+        if len(result.fetchall()) < len(new_page_ids):
+            raise HTTPException(status_code=404, detail="Page not found")
+
+    comments = await rows_by_id(db, "comments", project_id, updated_comment_ids + batch.delete_comments,
+                                COMMENT_COLUMNS)
+    if len(comments) < len(set(updated_comment_ids + batch.delete_comments)):
+        raise HTTPException(status_code=404, detail="Comment not found")
+    # Segment ids from the get_lines view erase their whole stroke, as delete_line does
+    segment_strokes = {line_id: line_id.split(STROKE_SEGMENT_SEPARATOR)[0]
+                       for line_id in batch.delete_lines if STROKE_SEGMENT_SEPARATOR in line_id}
+    delete_line_ids = [line_id for line_id in batch.delete_lines if line_id not in segment_strokes]
+    lines = await rows_by_id(db, "lines", project_id, updated_line_ids + delete_line_ids)
+    if len(lines) < len(set(updated_line_ids + delete_line_ids)):
+        raise HTTPException(status_code=404, detail="Line not found")
+    strokes = await rows_by_id(db, "strokes", project_id, list(set(segment_strokes.values())),
+                               "id, project_id, page_id")
+    if len(strokes) < len(set(segment_strokes.values())):
+        raise HTTPException(status_code=404, detail="Stroke not found")
+
+    # One revision per touched page for the whole batch; sorted so
+    # concurrent batches lock pages in the same order
+    touched = (new_page_ids | {row.page_id for row in comments.values()} | {row.page_id for row in lines.values()}
+               | {row.page_id for row in strokes.values()})
+    revisions = {}
+    for page_id in sorted(touched):
+        revisions[page_id] = await next_page_revision(db, project_id, page_id)
+
+    now = datetime.utcnow()
+    created_comments = [
+        {"id": str(uuid.uuid4()), "project_id": project_id, "page_id": c.page_id, "x": c.x, "y": c.y,
+         "text": c.text, "author": c.author, "resolved": False,
+         "created_at": now, "updated_at": now, "revision": revisions[c.page_id]}
+        for c in batch.create_comments
+    ]
+    created_lines = [
+        {"id": str(uuid.uuid4()), "project_id": project_id, "page_id": l.page_id,
+         "x1": l.x1, "y1": l.y1, "x2": l.x2, "y2": l.y2, "color": l.color, "author": l.author,
+         "created_at": now, "updated_at": now, "revision": revisions[l.page_id]}
+        for l in batch.create_lines
+    ]
+    if created_comments:
+        await db.execute(text(insert_sql("comments", created_comments[0])), created_comments)
+    if created_lines:
+        await db.execute(text(insert_sql("lines", created_lines[0])), created_lines)
+
+    updated_comments = await apply_batch_updates(db, "comments", batch.update_comments, comments, revisions, now)
+    updated_lines = await apply_batch_updates(db, "lines", batch.update_lines, lines, revisions, now)
+
+    deleted_comments = [comments[comment_id] for comment_id in dict.fromkeys(batch.delete_comments)]
+    deleted_lines = [lines[line_id] for line_id in dict.fromkeys(delete_line_ids)]
+    deleted_strokes = list(strokes.values())
+    if deleted_comments:
+        await db.execute(text("DELETE FROM comments WHERE id = :id"), [{"id": row.id} for row in deleted_comments])
+    if deleted_lines:
+        await db.execute(text("DELETE FROM lines WHERE id = :id"), [{"id": row.id} for row in deleted_lines])
+    if deleted_strokes:
+        await db.execute(text("DELETE FROM strokes WHERE id = :id"), [{"id": row.id} for row in deleted_strokes])
+    tombstones = (
+        [tombstone_params("comment", row, revisions[row.page_id], now) for row in deleted_comments]
+        + [tombstone_params("line", row, revisions[row.page_id], now) for row in deleted_lines]
+        + [tombstone_params("stroke", row, revisions[row.page_id], now) for row in deleted_strokes]
+    )
+    if tombstones:
+        await db.execute(text(TOMBSTONE_INSERT_SQL), tombstones)
+
+    open_delta = len(created_comments) - sum(1 for row in deleted_comments if not row.resolved)
+    for update in batch.update_comments:
+        resolved = update.model_dump(exclude_unset=True).get("resolved")
+        if resolved is not None and resolved != bool(comments[update.id].resolved):
+            open_delta += -1 if resolved else 1
+    deltas = {
+        "comment_count": len(created_comments) - len(deleted_comments),
+        "open_comment_count": open_delta,
+        "line_count": len(created_lines) - len(deleted_lines) - len(deleted_strokes),
+    }
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if deltas or created_comments:
+        await bump_project(db, project_id, touch=bool(created_comments), **deltas)
+    await db.commit()
+
+    response = BatchResponse(
+        comments=[CommentResponse(**row_data(row)) for row in created_comments + updated_comments],
+        lines=[LineResponse(**row_data(row)) for row in created_lines + updated_lines],
+        deleted_comments=[row.id for row in deleted_comments],
+        deleted_lines=[row.id for row in deleted_lines] + list(dict.fromkeys(segment_strokes)),
+    )
+
+    created = len(created_comments)
+    for i, comment in enumerate(response.comments):
+        await hub.publish(project_id, comment.page_id, "comment.created" if i < created else "comment.updated",
+                          comment.model_dump())
+    created = len(created_lines)
+    for i, line in enumerate(response.lines):
+        await hub.publish(project_id, line.page_id, "line.created" if i < created else "line.updated",
+                          line.model_dump())
+    for row in deleted_comments:
+        await hub.publish(project_id, row.page_id, "comment.deleted",
+                          {"id": row.id, "revision": revisions[row.page_id]})
+    for row in deleted_lines:
+        await hub.publish(project_id, row.page_id, "line.deleted",
+                          {"id": row.id, "revision": revisions[row.page_id]})
+    for row in deleted_strokes:
+        await hub.publish(project_id, row.page_id, "stroke.deleted",
+                          {"id": row.id, "revision": revisions[row.page_id]})
+    return response
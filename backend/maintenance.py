@@ -0,0 +1,237 @@
+"""
+Database maintenance helpers.
+
+Run from the backend directory:
+
+    python maintenance.py recompute-counters [--project-id ID]
+    python maintenance.py check-query-plans [--database-url URL]
+    python maintenance.py sweep-orphans [--batch-size N]
+    python maintenance.py check-query-counts [--projects N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from database import create_db_engine, engine
+
+
+RECOMPUTE_COUNTERS_SQL = """
+    UPDATE projects SET
+        comment_count = (SELECT COUNT(*) FROM comments c WHERE c.project_id = projects.id),
+        open_comment_count = (SELECT COUNT(*) FROM comments c WHERE c.project_id = projects.id AND NOT c.resolved),
+        page_count = (SELECT COUNT(*) FROM pages pg WHERE pg.project_id = projects.id),
+        line_count = (SELECT COUNT(*) FROM lines l WHERE l.project_id = projects.id)
+                   + (SELECT COUNT(*) FROM strokes s WHERE s.project_id = projects.id)
+"""
+
+
+async def recompute_project_counters(conn: AsyncConnection, project_id: Optional[str] = None) -> int:
+    """Recompute the denormalized counters on projects from the source tables."""
+    if project_id:
+        result = await conn.execute(text(RECOMPUTE_COUNTERS_SQL + " WHERE id = :id"), {"id": project_id})
+    else:
+        result = await conn.execute(text(RECOMPUTE_COUNTERS_SQL))
+    return result.rowcount
+
+
+async def _recompute_counters(project_id: Optional[str]):
+    async with engine.begin() as conn:
+        updated = await recompute_project_counters(conn, project_id)
+    await engine.dispose()
+    print(f"Recomputed counters for {updated} project(s)")
+
+
+async def _sweep_orphans(batch_size: int):
+    from cascade import sweep_orphans
+
+    deleted = await sweep_orphans(engine, batch_size)
+    # No counters to repair: delete_page takes a page's annotations off them up front
+    await engine.dispose()
+    for table, count in deleted.items():
+        print(f"{table}: deleted {count} orphaned row(s)")
+
+
+# Placeholder keyset cursor for the paginated variants
+CURSOR = {"after_time": "2024-01-01 00:00:00.000000", "after_id": "x", "limit": 51}
+
+
+def hot_queries() -> Dict[str, Tuple[str, dict]]:
+    """The SQL behind the hottest endpoints, with placeholder parameters."""
+    import main as api
+    from cascade import CHUNK_DELETE_SQL, PAGE_CHILD_TABLES
+
+    def keyset(sql, columns, paginated=False):
+        return api.keyset_sql(sql, columns, after=paginated, limit=paginated)
+
+    return {
+        "get_comments": (keyset(api.COMMENTS_BY_PAGE_SQL, api.COMMENTS_KEYSET), {"project_id": "p", "page_id": "pg"}),
+        "get_comments:page": (keyset(api.COMMENTS_BY_PAGE_SQL, api.COMMENTS_KEYSET, True),
+                              dict(CURSOR, project_id="p", page_id="pg")),
+        "get_lines": (api.LINES_BY_PAGE_SQL, {"project_id": "p", "page_id": "pg"}),
+        "get_pages": (api.PAGES_BY_PROJECT_SQL, {"project_id": "p"}),
+        "get_user_projects": (keyset(api.USER_PROJECTS_SQL, api.USER_PROJECTS_KEYSET), {"user_id": "u"}),
+        "get_user_projects:page": (keyset(api.USER_PROJECTS_SQL, api.USER_PROJECTS_KEYSET, True),
+                                   dict(CURSOR, user_id="u")),
+        "get_shared_projects": (keyset(api.SHARED_PROJECTS_SQL, api.SHARED_PROJECTS_KEYSET), {"user_id": "u"}),
+        "get_shared_projects:page": (keyset(api.SHARED_PROJECTS_SQL, api.SHARED_PROJECTS_KEYSET, True),
+                                     dict(CURSOR, user_id="u")),
+        "get_page_changes:comments": (api.COMMENTS_SINCE_SQL, {"project_id": "p", "page_id": "pg", "since": 0}),
+        "get_page_changes:lines": (api.LINES_SINCE_SQL, {"project_id": "p", "page_id": "pg", "since": 0}),
+        "get_page_changes:strokes": (api.STROKES_SINCE_SQL, {"project_id": "p", "page_id": "pg", "since": 0}),
+        "get_strokes": (api.STROKES_BY_PAGE_SQL, {"project_id": "p", "page_id": "pg"}),
+        "get_page_changes:tombstones": (api.TOMBSTONES_SINCE_SQL, {"project_id": "p", "page_id": "pg", "since": 0}),
+        "viewport_revision": (api.PAGE_REVISION_SQL, {"project_id": "p", "page_id": "pg"}),
+        "next_page_revision": (api.PAGE_REVISION_BUMP_SQL, {"project_id": "p", "page_id": "pg"}),
+        "search:projects": (api.ACCESSIBLE_PROJECTS_SQL, {"user_id": "u"}),
+        "get_project": (api.PROJECT_SUMMARY_SELECT + " WHERE p.id = :id", {"id": "p"}),
+        "get_user_by_name": (api.USER_BY_NAME_SQL, {"name": "n"}),
+        "share_project": (api.SHARE_LOOKUP_SQL, {"project_id": "p", "user_id": "u"}),
+        "snapshot:comments": (api.SNAPSHOT_COMMENTS_SQL, {"project_id": "p"}),
+        "snapshot:lines": (api.SNAPSHOT_LINES_SQL, {"project_id": "p"}),
+        "snapshot:strokes": (api.SNAPSHOT_STROKES_SQL, {"project_id": "p"}),
+        "delete_page:counts": (api.PAGE_ANNOTATION_COUNTS_SQL, {"project_id": "p", "page_id": "pg"}),
+        **{
+            f"cascade:{table}": (CHUNK_DELETE_SQL.format(table=table, where="project_id = :project_id"),
+                                 {"project_id": "p", "batch": 500})
+            for table in PAGE_CHILD_TABLES + ("pages",)
+        },
+    }
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    # "SCAN t" reads the whole table (or a whole index); "SEARCH t USING ..." is a range lookup
+    return [detail for detail in plan if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail]
+
+
+async def check_query_plans(conn: AsyncConnection) -> List[str]:
+    """EXPLAIN QUERY PLAN every hot query; return a description of each full scan."""
+    failures = []
+    for name, (sql, params) in hot_queries().items():
+        result = await conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)
+        plan = [row.detail for row in result.fetchall()]
+        for detail in full_scans(plan):
+            failures.append(f"{name}: {detail}")
+    return failures
+
+
+async def _check_query_plans(database_url: Optional[str]) -> bool:
+    from migrations import run_migrations
+
+    # By default check a scratch database built by the migrations, so the
+    # result depends on the schema rather than on what data happens to exist
+    scratch = database_url is None
+    if scratch:
+        database_url = "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "plans.db")
+    check_engine = create_db_engine(database_url)
+    if check_engine.dialect.name != "sqlite":
+        print("Query plan checks only run against SQLite")
+        return True
+
+    async with check_engine.begin() as conn:
+        if scratch:
+            await run_migrations(conn)
+        failures = await check_query_plans(conn)
+    await check_engine.dispose()
+
+    for failure in failures:
+        print(f"FULL SCAN  {failure}")
+    if not failures:
+        print(f"All {len(hot_queries())} hot queries use indexes")
+    return not failures
+
+
+async def listing_query_counts(check_engine: AsyncEngine, sizes: List[int]) -> Dict[str, List[int]]:
+    """
+    Statements the project listings run for a user who owns (and has been
+    shared) each of `sizes` projects in turn, every project with a page.
+    """
+    import main as api
+    from fastapi import Response
+    from starlette.requests import Request
+
+    statements = []
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(check_engine.sync_engine, "before_cursor_execute", record)
+
+    counts = {"get_user_projects": [], "get_shared_projects": []}
+    async with AsyncSession(check_engine, expire_on_commit=False) as db:
+        owner = await api.create_user(api.UserCreate(name="owner"), db)
+        reader = await api.create_user(api.UserCreate(name="reader"), db)
+        created = 0
+        for size in sizes:
+            for _ in range(created, size):
+                project = await api.create_project(owner.id, api.ProjectCreate(title=f"Project {created}"), db)
+                await api.create_page(project.id, api.PageCreate(url="https://example.com"), db)
+                await api.share_project(project.id, api.ShareRequest(username="reader"), db)
+                created += 1
+            for name, user_id in (("get_user_projects", owner.id), ("get_shared_projects", reader.id)):
+                # Measure a cold row cache, as the first request after a restart sees it
+                await api.row_cache.invalidate("user", user_id)
+                statements.clear()
+                request = Request({"type": "http", "method": "GET", "headers": []})
+                listing = getattr(api, name)
+                await listing(user_id, request, Response(), limit=None, after=None, db=db)
+                counts[name].append(len(statements))
+
+    event.remove(check_engine.sync_engine, "before_cursor_execute", record)
+    return counts
+
+
+async def _check_query_counts(projects: int) -> bool:
+    from migrations import run_migrations
+
+    check_engine = create_db_engine("sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "counts.db"))
+    async with check_engine.begin() as conn:
+        await run_migrations(conn)
+    sizes = [1, projects]
+    counts = await listing_query_counts(check_engine, sizes)
+    await check_engine.dispose()
+
+    ok = True
+    for name, per_size in counts.items():
+        constant = len(set(per_size)) == 1
+        ok = ok and constant
+        detail = ", ".join(f"{count} for {size}" for count, size in zip(per_size, sizes))
+        print(f"{'OK' if constant else 'GROWS'}  {name}: {detail} project(s)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recompute = commands.add_parser("recompute-counters", help="Recompute per-project counters")
+    recompute.add_argument("--project-id", help="Only repair this project")
+
+    plans = commands.add_parser("check-query-plans", help="Fail if a hot query falls back to a full scan")
+    plans.add_argument("--database-url", help="Check this database instead of a fresh scratch one")
+
+    sweep = commands.add_parser("sweep-orphans", help="Delete rows left behind by deleted projects and pages")
+    sweep.add_argument("--batch-size", type=int, default=500, help="Rows examined per transaction")
+
+    counts = commands.add_parser("check-query-counts",
+                                 help="Fail if the project listings run more statements for more projects")
+    counts.add_argument("--projects", type=int, default=50, help="Projects in the larger listing")
+
+    args = parser.parse_args()
+    if args.command == "recompute-counters":
+        asyncio.run(_recompute_counters(args.project_id))
+    elif args.command == "check-query-plans":
+        if not asyncio.run(_check_query_plans(args.database_url)):
+            sys.exit(1)
+    elif args.command == "sweep-orphans":
+        asyncio.run(_sweep_orphans(args.batch_size))
+    elif args.command == "check-query-counts":
+        if not asyncio.run(_check_query_counts(args.projects)):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
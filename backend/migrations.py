@@ -0,0 +1,231 @@
+"""
+Versioned schema migrations, applied in order at startup.
+
+Each migration runs once and is recorded in schema_migrations. A fresh
+database is created from the current models by the first migration, so
+later migrations must tolerate their changes already being present.
+"""
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db_models import Base, Project, User, ProjectShare, Comment, Line, Page, Stroke, Tombstone
+from maintenance import recompute_project_counters
+import polyline
+import search
+
+
+# Single-column indexes superseded by the composite ones in migration 3
+LEGACY_INDEXES = [
+    "ix_projects_user_id",
+    "ix_pages_project_id",
+    "ix_project_shares_project_id",
+    "ix_project_shares_shared_with_user_id",
+    "ix_comments_project_id",
+    "ix_comments_page_id",
+    "ix_lines_project_id",
+    "ix_lines_page_id",
+]
+
+
+async def add_missing_columns(conn: AsyncConnection, table) -> List[str]:
+    """Add columns declared on the model but missing from an existing table."""
+    def existing_columns(sync_conn):
+        return {column["name"] for column in inspect(sync_conn).get_columns(table.name)}
+
+    existing = await conn.run_sync(existing_columns)
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+        if column.server_default is not None:
+            ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+        await conn.execute(text(ddl))
+        added.append(column.name)
+    return added
+
+
+async def create_indexes(conn: AsyncConnection, *tables):
+    def existing_columns(sync_conn, table):
+        return {column["name"] for column in inspect(sync_conn).get_columns(table.name)}
+
+    for table in tables:
+        columns = await conn.run_sync(existing_columns, table)
+        for index in table.indexes:
+            # Indexes on columns a later migration adds are created by that migration
+            if all(column.name in columns for column in index.columns):
+                await conn.run_sync(index.create, checkfirst=True)
+
+
+async def initial_schema(conn: AsyncConnection):
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def project_counters(conn: AsyncConnection):
+    if await add_missing_columns(conn, Project.__table__):
+        await recompute_project_counters(conn)
+
+
+async def merge_duplicate_users(conn: AsyncConnection):
+    """Fold users that share a name into the oldest one before name becomes unique."""
+    result = await conn.execute(text("""
+        SELECT id, name FROM users
+        WHERE name IN (SELECT name FROM users GROUP BY name HAVING COUNT(*) > 1)
+        ORDER BY name, created_at, id
+    """))
+    keep = {}
+    for row in result.fetchall():
+        if row.name not in keep:
+            keep[row.name] = row.id
+            continue
+        params = {"keep": keep[row.name], "dup": row.id}
+        await conn.execute(text("UPDATE projects SET user_id = :keep WHERE user_id = :dup"), params)
+        await conn.execute(
+            text("UPDATE project_shares SET shared_with_user_id = :keep WHERE shared_with_user_id = :dup"),
+            params
+        )
+        await conn.execute(text("DELETE FROM users WHERE id = :dup"), params)
+
+
+async def rename_duplicate_projects(conn: AsyncConnection):
+    """Number the later of a user's same-titled projects before (user_id, title) becomes unique."""
+    result = await conn.execute(text("""
+        SELECT id, user_id, title FROM projects
+        WHERE (user_id, title) IN (
+            SELECT user_id, title FROM projects WHERE title IS NOT NULL
+            GROUP BY user_id, title HAVING COUNT(*) > 1
+        )
+        ORDER BY user_id, title, created_at, id
+    """))
+    rows = result.fetchall()
+    if not rows:
+        return
+    result = await conn.execute(
+        text("SELECT user_id, title FROM projects WHERE user_id IN :user_ids AND title IS NOT NULL")
+        .bindparams(bindparam("user_ids", expanding=True)),
+        {"user_ids": list({row.user_id for row in rows})}
+    )
+    taken = {(row.user_id, row.title) for row in result.fetchall()}
+    seen = set()
+    for row in rows:
+        if (row.user_id, row.title) not in seen:
+            seen.add((row.user_id, row.title))
+            continue
+        n = 2
+        while (row.user_id, f"{row.title} ({n})") in taken:
+            n += 1
+        title = f"{row.title} ({n})"
+        taken.add((row.user_id, title))
+        await conn.execute(text("UPDATE projects SET title = :title WHERE id = :id"), {"title": title, "id": row.id})
+
+
+async def hot_path_indexes(conn: AsyncConnection):
+    await merge_duplicate_users(conn)
+    # Merging users can bring same-titled projects together
+    await rename_duplicate_projects(conn)
+    # Shares may have been duplicated by concurrent requests
+    await conn.execute(text("""
+        DELETE FROM project_shares WHERE id NOT IN (
+            SELECT MIN(id) FROM project_shares GROUP BY project_id, shared_with_user_id
+        )
+    """))
+    for name in LEGACY_INDEXES:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    await create_indexes(conn, User.__table__, Project.__table__, Page.__table__,
+                         ProjectShare.__table__, Comment.__table__, Line.__table__)
+
+
+async def annotation_revisions(conn: AsyncConnection):
+    added = []
+    for table in (Page.__table__, Comment.__table__, Line.__table__):
+        added += await add_missing_columns(conn, table)
+    if added:
+        # Existing annotations become revision 1 so a first sync from 0 sees them
+        await conn.execute(text("UPDATE comments SET revision = 1, updated_at = created_at"))
+        await conn.execute(text("UPDATE lines SET revision = 1, updated_at = created_at"))
+        await conn.execute(text("UPDATE pages SET revision = 1"))
+    await conn.run_sync(Tombstone.__table__.create, checkfirst=True)
+    await create_indexes(conn, Comment.__table__, Line.__table__)
+
+
+async def strokes(conn: AsyncConnection):
+    await conn.run_sync(Stroke.__table__.create, checkfirst=True)
+
+
+async def keyset_indexes(conn: AsyncConnection):
+    """Extend the listing indexes with the id tie-breaker used by keyset pagination."""
+    for table, name in [(Project.__table__, "ix_projects_user_updated"),
+                        (ProjectShare.__table__, "ix_project_shares_user_created"),
+                        (Comment.__table__, "ix_comments_project_page_created")]:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        index = next(index for index in table.indexes if index.name == name)
+        await conn.run_sync(index.create)
+
+
+async def comment_search(conn: AsyncConnection):
+    await search.install(conn)
+
+
+async def project_revisions(conn: AsyncConnection):
+    await add_missing_columns(conn, Project.__table__)
+
+
+async def unique_project_titles(conn: AsyncConnection):
+    await rename_duplicate_projects(conn)
+    await create_indexes(conn, Project.__table__)
+
+
+async def stroke_quanta(conn: AsyncConnection):
+    """Record the quantum of delta strokes written before it was stored per row."""
+    # Those rows were packed with the STROKE_QUANTUM this deployment runs with
+    await conn.execute(
+        text("UPDATE strokes SET encoding = :encoding WHERE encoding = 'delta'"),
+        {"encoding": polyline.storage_encoding("delta", polyline.STROKE_QUANTUM)}
+    )
+
+
+MIGRATIONS = [
+    (1, "initial_schema", initial_schema),
+    (2, "project_counters", project_counters),
+    (3, "hot_path_indexes", hot_path_indexes),
+    (4, "annotation_revisions", annotation_revisions),
+    (5, "strokes", strokes),
+    (6, "keyset_indexes", keyset_indexes),
+    (7, "comment_search", comment_search),
+    (8, "project_revisions", project_revisions),
+    (9, "unique_project_titles", unique_project_titles),
+    (10, "stroke_quanta", stroke_quanta),
+]
+
+
+async def run_migrations(conn: AsyncConnection) -> List[str]:
+    """Apply pending migrations inside the caller's transaction."""
+    if conn.dialect.name == "postgresql":
+        # Several workers may start at once; let one of them migrate
+        await conn.execute(text("SELECT pg_advisory_xact_lock(724193)"))
+
+    await conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+    """))
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    applied = {row.version for row in result.fetchall()}
+
+    ran = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        await migrate(conn)
+        await conn.execute(
+            text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :now)"),
+            {"version": version, "name": name, "now": datetime.utcnow()}
+        )
+        ran.append(name)
+    return ran
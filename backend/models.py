@@ -1,6 +1,6 @@
 # Re-export for backwards compatibility
 from db_models import (
-    User, Project, ProjectShare, Comment, Line, Page, Base
+    User, Project, ProjectShare, Comment, Line, Page, Stroke, Tombstone, Base
 )
 from schemas import (
     UserCreate, UserResponse,
@@ -8,5 +8,11 @@ from schemas import (
     ShareRequest, ShareResponse,
     CommentCreate, CommentUpdate, CommentResponse,
     LineCreate, LineUpdate, LineResponse,
+    StrokeCreate, StrokeResponse,
+    SearchResult, SearchResponse,
     PageCreate, PageUpdate, PageResponse,
+    PageChangesResponse,
+    BatchRequest, BatchResponse,
+    DeleteResponse, DeletionJobResponse,
+    SnapshotPage, SnapshotResponse,
 )
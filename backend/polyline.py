@@ -0,0 +1,144 @@
+"""
+Packed storage for freehand strokes.
+
+A stroke's points are stored in one BLOB instead of one row per segment.
+Two encodings are supported:
+
+    f32    x,y pairs as little-endian float32 (8 bytes per point)
+    delta  coordinates quantized to STROKE_QUANTUM and stored as zigzag
+           varint deltas from the previous point (typically 2-4 bytes per
+           point, since consecutive points of a stroke are close together)
+
+Coordinates are page percentages, so the default quantum of 0.01 keeps
+every point within 0.005% of where it was drawn. The quantum is saved with
+each row as part of its encoding ("delta:0.01"), so changing STROKE_QUANTUM
+only affects strokes drawn afterwards.
+"""
+import math
+import os
+from array import array
+from typing import List, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+STROKE_ENCODING = os.getenv("STROKE_ENCODING", "delta")
+STROKE_QUANTUM = float(os.getenv("STROKE_QUANTUM", "0.01"))
+STROKE_SIMPLIFY_TOLERANCE = float(os.getenv("STROKE_SIMPLIFY_TOLERANCE", "0.05"))
+
+ENCODINGS = ("f32", "delta")
+
+
+def storage_encoding(encoding: str = STROKE_ENCODING, quantum: float = STROKE_QUANTUM) -> str:
+    """The value stored in strokes.encoding: the encoding, plus its quantum for delta."""
+    return f"delta:{quantum:g}" if encoding == "delta" else encoding
+
+
+def parse_encoding(stored: str) -> Tuple[str, float]:
+    # A bare "delta" predates stored quanta; migration 10 rewrites those rows
+    encoding, _, quantum = stored.partition(":")
+    return encoding, float(quantum) if quantum else STROKE_QUANTUM
+
+
+STROKE_STORAGE_ENCODING = storage_encoding()
+
+
+def pairs(flat: Sequence[float]) -> List[Point]:
+    return list(zip(flat[0::2], flat[1::2]))
+
+
+def flatten(points: Sequence[Point]) -> List[float]:
+    return [coordinate for point in points for coordinate in point]
+
+
+def _perpendicular_distance(point: Point, start: Point, end: Point) -> float:
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return math.hypot(point[0] - start[0], point[1] - start[1])
+    return abs(dy * point[0] - dx * point[1] + end[0] * start[1] - end[1] * start[0]) / length
+
+
+def simplify(points: Sequence[Point], tolerance: float) -> List[Point]:
+    """Ramer-Douglas-Peucker: drop points closer than `tolerance` to the simplified line."""
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # Iterative so long scribbles cannot hit the recursion limit
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, max_distance = first, 0.0
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        if max_distance > tolerance:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def bounding_box(points: Sequence[Point]) -> Tuple[float, float, float, float]:
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _write_varint(out: bytearray, value: int):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data: bytes) -> List[int]:
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value, shift = 0, 0
+    return values
+
+
+def pack(points: Sequence[Point], stored_encoding: str = STROKE_STORAGE_ENCODING) -> bytes:
+    encoding, quantum = parse_encoding(stored_encoding)
+    if encoding == "f32":
+        packed = array("f", flatten(points))
+        if packed.itemsize != 4 or array("H", [1]).tobytes() != b"\x01\x00":
+            raise RuntimeError("f32 stroke encoding needs a little-endian 4-byte float")
+        return packed.tobytes()
+    if encoding == "delta":
+        out = bytearray()
+        previous_x = previous_y = 0
+        for x, y in points:
+            qx, qy = round(x / quantum), round(y / quantum)
+            _write_varint(out, qx - previous_x)
+            _write_varint(out, qy - previous_y)
+            previous_x, previous_y = qx, qy
+        return bytes(out)
+    raise ValueError(f"Unknown stroke encoding {encoding!r}")
+
+
+def unpack(data: bytes, stored_encoding: str) -> List[Point]:
+    encoding, quantum = parse_encoding(stored_encoding)
+    if encoding == "f32":
+        values = array("f")
+        values.frombytes(data)
+        return pairs(values.tolist())
+    if encoding == "delta":
+        points = []
+        x = y = 0
+        deltas = _read_varints(data)
+        for dx, dy in zip(deltas[0::2], deltas[1::2]):
+            x += dx
+            y += dy
+            points.append((round(x * quantum, 6), round(y * quantum, 6)))
+        return points
+    raise ValueError(f"Unknown stroke encoding {encoding!r}")
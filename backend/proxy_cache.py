@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+
+PROXY_CACHE_TTL = float(os.getenv("PROXY_CACHE_TTL", "300"))
+PROXY_CACHE_MAX_BYTES = int(os.getenv("PROXY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PROXY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("PROXY_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+PROXY_CACHE_DIR = os.getenv("PROXY_CACHE_DIR", "")
+PROXY_CACHE_DISK_MAX_BYTES = int(os.getenv("PROXY_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Cache key for a proxied URL: lowercase scheme/host, no default port, no fragment."""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+class CacheEntry:
+    def __init__(
+        self,
+        content: bytes,
+        status_code: int,
+        headers: Dict[str, str],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        stored_at: Optional[float] = None,
+    ):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.stored_at < ttl
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def metadata(self) -> dict:
+        return {
+            "status_code": self.status_code,
+            "headers": self.headers,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "stored_at": self.stored_at,
+        }
+
+
+class DiskTier:
+    """
+    Second-level cache on local disk. Each entry is a JSON metadata line
+    followed by the body, stored under the SHA-256 of its key.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def read(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._path(key), "rb") as f:
+                meta = json.loads(f.readline())
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(content=content, **meta)
+
+    def write(self, key: str, entry: CacheEntry):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(entry.metadata()).encode() + b"\n")
+            f.write(entry.content)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+        files.sort()
+        while total > self.max_bytes and files:
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class ProxyCache:
+    """
+    LRU cache of rewritten proxy responses bounded by a byte budget.
+    Stale entries are kept so they can be revalidated with a conditional GET.
+    """
+
+    def __init__(
+        self,
+        ttl: float = PROXY_CACHE_TTL,
+        max_bytes: int = PROXY_CACHE_MAX_BYTES,
+        max_entry_bytes: int = PROXY_CACHE_MAX_ENTRY_BYTES,
+        disk_dir: str = PROXY_CACHE_DIR,
+        disk_max_bytes: int = PROXY_CACHE_DISK_MAX_BYTES,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk = DiskTier(disk_dir, disk_max_bytes) if disk_dir else None
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, entry: CacheEntry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old.size
+        self._entries[key] = entry
+        self._size += entry.size
+        while self._size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        if self.disk is not None:
+            entry = await asyncio.to_thread(self.disk.read, key)
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    async def put(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_entry_bytes:
+            return
+        self._remember(key, entry)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.write, key, entry)
+
+    async def refresh(self, key: str, entry: CacheEntry):
+        """Mark an entry as fresh again after a 304 from upstream."""
+        self.revalidations += 1
+        entry.stored_at = time.time()
+        await self.put(key, entry)
+
+    async def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "disk": self.disk is not None,
+        }
+
+
+proxy_cache = ProxyCache()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+PROXY_TIMEOUT = float(os.getenv("PROXY_TIMEOUT", "30"))
+PROXY_CONNECT_TIMEOUT = float(os.getenv("PROXY_CONNECT_TIMEOUT", "10"))
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE = int(os.getenv("PROXY_MAX_KEEPALIVE", "20"))
+PROXY_KEEPALIVE_EXPIRY = float(os.getenv("PROXY_KEEPALIVE_EXPIRY", "30"))
+PROXY_MAX_CONNECTIONS_PER_HOST = int(os.getenv("PROXY_MAX_CONNECTIONS_PER_HOST", "10"))
+PROXY_HTTP2 = os.getenv("PROXY_HTTP2", "1").lower() not in ("0", "false", "no")
+
+
+class ProxyClient:
+    """
+    Application-wide pooled HTTP client for outbound proxy fetches.
+    Created once at startup so repeat hosts reuse keep-alive connections.
+    """
+
+    def __init__(
+        self,
+        timeout: float = PROXY_TIMEOUT,
+        connect_timeout: float = PROXY_CONNECT_TIMEOUT,
+        max_connections: int = PROXY_MAX_CONNECTIONS,
+        max_keepalive: int = PROXY_MAX_KEEPALIVE,
+        keepalive_expiry: float = PROXY_KEEPALIVE_EXPIRY,
+        max_per_host: int = PROXY_MAX_CONNECTIONS_PER_HOST,
+        http2: bool = PROXY_HTTP2,
+    ):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_per_host = max_per_host
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                follow_redirects=True,
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_slots.clear()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Proxy client is not started")
+        return self._client
+
+    @asynccontextmanager
+    async def host_slot(self, host: str):
+        # Cap concurrent upstream connections per origin so one slow site
+        # cannot take over the whole pool.
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        async with slot:
+            yield
+
+    @asynccontextmanager
+    async def stream(self, url: str, host: str, **kwargs):
+        """Open a streamed GET; the host slot is held until the body is closed."""
+        async with self.host_slot(host):
+            async with self.client.stream("GET", url, **kwargs) as response:
+                yield response
+
+
+proxy_client = ProxyClient()
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+REALTIME_REDIS_URL = os.getenv("REALTIME_REDIS_URL", "")
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "256"))
+REALTIME_KEEPALIVE = float(os.getenv("REALTIME_KEEPALIVE", "15"))
+
+# Seconds between Redis reconnect attempts, doubling up to the maximum
+REDIS_RETRY_DELAY = 0.5
+REDIS_RETRY_MAX_DELAY = 30.0
+
+Deliver = Callable[[str, str], Awaitable[None]]
+
+
+def page_channel(project_id: str, page_id: str) -> str:
+    return f"{project_id}:{page_id}"
+
+
+class Broker(ABC):
+    """
+    Carries published events to every worker's hub. The local broker hands
+    them straight back to this process; a shared broker such as Redis lets
+    several uvicorn workers see each other's events.
+    """
+
+    reconnects = 0
+
+    async def start(self, deliver: Deliver, resync: Callable[[], None] = lambda: None):
+        """`resync` is called when events may have been lost, e.g. across a reconnect."""
+        self.deliver = deliver
+        self.resync = resync
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        ...
+
+    async def close(self):
+        pass
+
+
+class LocalBroker(Broker):
+    async def publish(self, channel: str, message: str):
+        await self.deliver(channel, message)
+
+
+class RedisBroker(Broker):
+    prefix = "annotate:page:"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("REALTIME_REDIS_URL needs the redis package: pip install -r requirements-redis.txt")
+
+        self.redis = redis.from_url(url)
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver, resync: Callable[[], None] = lambda: None):
+        await super().start(deliver, resync)
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.psubscribe(self.prefix + "*")
+
+    async def _listen(self):
+        delay = REDIS_RETRY_DELAY
+        while True:
+            try:
+                async for message in self.pubsub.listen():
+                    delay = REDIS_RETRY_DELAY
+                    if message["type"] != "pmessage":
+                        continue
+                    channel = message["channel"].decode()[len(self.prefix):]
+                    await self.deliver(channel, message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Redis pub/sub connection lost; reconnecting in %.1fs", delay, exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, REDIS_RETRY_MAX_DELAY)
+            try:
+                await self.pubsub.aclose()
+            except Exception:
+                pass
+            try:
+                await self._subscribe()
+            except Exception:
+                logger.warning("Redis pub/sub reconnect failed", exc_info=True)
+                continue
+            self.reconnects += 1
+            # Events published while disconnected are gone; subscribers must reload
+            self.resync()
+
+    async def publish(self, channel: str, message: str):
+        await self.redis.publish(self.prefix + channel, message)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+
+class Subscription:
+    def __init__(self, channel: str, maxsize: int):
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def offer(self, message: str):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A subscriber that cannot keep up is cut off rather than silently
+            # missing deltas; the client reloads and resubscribes.
+            self.cut_off()
+
+    def cut_off(self):
+        if self.overflowed:
+            return
+        self.overflowed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Next message, "" on timeout, or None once the subscription overflowed."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return ""
+
+
+class Hub:
+    """In-process fan-out of annotation events to per-page subscribers."""
+
+    def __init__(self, broker: Optional[Broker] = None, queue_size: int = REALTIME_QUEUE_SIZE):
+        self.broker = broker or LocalBroker()
+        self.queue_size = queue_size
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    async def start(self):
+        await self.broker.start(self._deliver, self._resync)
+
+    async def close(self):
+        await self.broker.close()
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, self.queue_size)
+        self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._channels.get(subscription.channel)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._channels[subscription.channel]
+
+    async def publish(self, project_id: str, page_id: str, event_type: str, data: dict):
+        message = json.dumps({"type": event_type, "data": data})
+        self.published += 1
+        await self.broker.publish(page_channel(project_id, page_id), message)
+
+    async def _deliver(self, channel: str, message: str):
+        for subscription in list(self._channels.get(channel, ())):
+            subscription.offer(message)
+            self.delivered += 1
+
+    def _resync(self):
+        # Cut everyone off, as on overflow, so no client keeps a view with gaps
+        for subscribers in self._channels.values():
+            for subscription in subscribers:
+                subscription.cut_off()
+
+    def stats(self) -> dict:
+        return {
+            "broker_reconnects": self.broker.reconnects,
+            "channels": len(self._channels),
+            "subscribers": sum(len(subs) for subs in self._channels.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+def create_hub() -> Hub:
+    broker = RedisBroker(REALTIME_REDIS_URL) if REALTIME_REDIS_URL else LocalBroker()
+    return Hub(broker)
+
+
+hub = create_hub()
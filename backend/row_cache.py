@@ -0,0 +1,160 @@
+"""
+Read-through cache for the small rows most requests check before doing
+anything: users, project metadata and pages.
+
+Only fields that a handful of endpoints change are cached (ids, owner,
+titles, page url and order), never the counters, updated_at or revisions
+that every annotation write moves. The endpoints that change a cached field
+invalidate its entry, and entries expire after ROW_CACHE_TTL.
+
+The default backend is per worker, so with several workers an invalidation
+only reaches the worker that made it; the others catch up within the TTL.
+Set ROW_CACHE_REDIS_URL to keep one shared cache instead (this needs the
+optional redis package from requirements-redis.txt).
+"""
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+ROW_CACHE_TTL = float(os.getenv("ROW_CACHE_TTL", "60"))
+ROW_CACHE_MAX_ENTRIES = int(os.getenv("ROW_CACHE_MAX_ENTRIES", "10000"))
+ROW_CACHE_REDIS_URL = os.getenv("ROW_CACHE_REDIS_URL", "")
+
+Loader = Callable[[], Awaitable[Optional[dict]]]
+
+
+class CacheBackend(ABC):
+    """Where cached rows live: this process, or a store shared by every worker."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl: float):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class LocalBackend(CacheBackend):
+    """Bounded LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = ROW_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class RedisBackend(CacheBackend):
+    prefix = "annotate:row:"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("ROW_CACHE_REDIS_URL needs the redis package: pip install -r requirements-redis.txt")
+
+        self.redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = await self.redis.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: dict, ttl: float):
+        await self.redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self.redis.delete(self.prefix + key)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class RowCache:
+    """Rows by kind ("user", "project", "page") and id, loaded on a miss."""
+
+    def __init__(self, backend: CacheBackend, ttl: float = ROW_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, kind: str, counter: str):
+        counters = self._counters.setdefault(kind, {"hits": 0, "misses": 0, "invalidations": 0})
+        counters[counter] += 1
+
+    async def get(self, kind: str, row_id: str, load: Loader) -> Optional[dict]:
+        """The cached row, or `load()`'s result (cached unless None: a missing row may appear later)."""
+        if self.ttl <= 0:
+            return await load()
+        value = await self.backend.get(f"{kind}:{row_id}")
+        if value is not None:
+            self._count(kind, "hits")
+            return value
+        self._count(kind, "misses")
+        value = await load()
+        if value is not None:
+            await self.backend.set(f"{kind}:{row_id}", value, self.ttl)
+        return value
+
+    async def put(self, kind: str, row_id: str, value: dict):
+        if self.ttl > 0:
+            await self.backend.set(f"{kind}:{row_id}", value, self.ttl)
+
+    async def invalidate(self, kind: str, row_id: str):
+        self._count(kind, "invalidations")
+        await self.backend.delete(f"{kind}:{row_id}")
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> dict:
+        kinds = {}
+        for kind, counters in self._counters.items():
+            lookups = counters["hits"] + counters["misses"]
+            kinds[kind] = dict(counters, hit_rate=counters["hits"] / lookups if lookups else 0.0)
+        return {"ttl": self.ttl, "shared": not isinstance(self.backend, LocalBackend),
+                "backend": self.backend.stats(), "kinds": kinds}
+
+
+def create_row_cache() -> RowCache:
+    backend = RedisBackend(ROW_CACHE_REDIS_URL) if ROW_CACHE_REDIS_URL else LocalBackend()
+    return RowCache(backend)
+
+
+row_cache = create_row_cache()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 
@@ -30,7 +30,9 @@ class ProjectResponse(BaseModel):
     created_at: str
     updated_at: str
     comment_count: int = 0
+    open_comment_count: int = 0
     page_count: int = 0
+    line_count: int = 0
     owner_name: Optional[str] = None
 
 
@@ -91,6 +93,8 @@ class CommentResponse(BaseModel):
     author: str
     resolved: bool
     created_at: str
+    updated_at: Optional[str] = None
+    revision: int = 0
 
 
 # Line schemas
@@ -123,3 +127,107 @@ class LineResponse(BaseModel):
     color: str
     author: str
     created_at: str
+    updated_at: Optional[str] = None
+    revision: int = 0
+
+
+# Search schemas
+class SearchResult(CommentResponse):
+    project_title: Optional[str] = None
+    # Escaped comment text around the match, matched words wrapped in <mark>
+    snippet: str
+    score: float
+
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+    next_offset: Optional[int] = None
+
+
+# Stroke schemas
+class StrokeCreate(BaseModel):
+    page_id: str
+    # Flat [x1, y1, x2, y2, ...] in page percentages
+    points: List[float]
+    color: str
+    author: str
+    # Simplification tolerance in page percent; 0 keeps every point
+    tolerance: Optional[float] = None
+
+
+class StrokeResponse(BaseModel):
+    id: str
+    project_id: str
+    page_id: str
+    points: List[float]
+    color: str
+    author: str
+    created_at: str
+    updated_at: Optional[str] = None
+    revision: int = 0
+
+
+# Batch mutations
+class CommentBatchUpdate(CommentUpdate):
+    id: str
+
+
+class LineBatchUpdate(LineUpdate):
+    id: str
+
+
+class BatchRequest(BaseModel):
+    create_comments: List[CommentCreate] = []
+    update_comments: List[CommentBatchUpdate] = []
+    delete_comments: List[str] = []
+    create_lines: List[LineCreate] = []
+    update_lines: List[LineBatchUpdate] = []
+    delete_lines: List[str] = []
+
+
+class BatchResponse(BaseModel):
+    comments: List[CommentResponse]
+    lines: List[LineResponse]
+    deleted_comments: List[str]
+    deleted_lines: List[str]
+
+
+# Incremental sync
+class PageChangesResponse(BaseModel):
+    revision: int
+    comments: List[CommentResponse]
+    lines: List[LineResponse]
+    strokes: List[StrokeResponse]
+    deleted_comments: List[str]
+    deleted_lines: List[str]
+    deleted_strokes: List[str]
+
+
+# Whole-project snapshot
+class SnapshotPage(PageResponse):
+    revision: int = 0
+
+
+class SnapshotResponse(BaseModel):
+    project: ProjectResponse
+    pages: List[SnapshotPage]
+    # Keyed by page id, ordered as get_comments and get_lines return them
+    comments: Dict[str, List[CommentResponse]]
+    lines: Dict[str, List[LineResponse]]
+
+
+# Background cascade deletion
+class DeleteResponse(BaseModel):
+    deleted: bool
+    job_id: str
+
+
+class DeletionJobResponse(BaseModel):
+    id: str
+    kind: str
+    target_id: str
+    status: str
+    deleted: Dict[str, int]
+    error: Optional[str] = None
+    created_at: str
+    finished_at: Optional[str] = None
@@ -0,0 +1,142 @@
+"""
+Full-text search over comment text.
+
+SQLite uses an FTS5 table, comment_search, maintained by triggers on
+comments, so every write path (single, batch, cascades) keeps it current.
+Each comment stores the FTS rowid it was given in comments.search_rowid;
+the link never depends on the table's implicit rowid. The project id is
+indexed as a second FTS column so a query only ranks comments in the
+caller's projects.
+
+PostgreSQL uses a generated tsvector column on comments with a GIN index.
+"""
+import html
+import re
+from typing import List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+# Snippet highlight markers; swapped for <mark> after the text is escaped
+MARK_START = "\x02"
+MARK_END = "\x03"
+SNIPPET_WORDS = 12
+
+SQLITE_DDL = [
+    "ALTER TABLE comments ADD COLUMN search_rowid INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_comments_search_rowid ON comments (search_rowid)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS comment_search USING fts5(
+        text, project_id, tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+    """,
+    # Backfill, reusing the current rowids as the comments' search ids
+    """
+    INSERT INTO comment_search (rowid, text, project_id)
+    SELECT rowid, text, replace(project_id, '-', '') FROM comments
+    """,
+    "UPDATE comments SET search_rowid = rowid",
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments BEGIN
+        INSERT INTO comment_search (text, project_id) VALUES (NEW.text, replace(NEW.project_id, '-', ''));
+        UPDATE comments SET search_rowid = last_insert_rowid() WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_search_update AFTER UPDATE OF text ON comments BEGIN
+        UPDATE comment_search SET text = NEW.text WHERE rowid = NEW.search_rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS comments_search_delete AFTER DELETE ON comments BEGIN
+        DELETE FROM comment_search WHERE rowid = OLD.search_rowid;
+    END
+    """,
+]
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE comments ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', text)) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_comments_search_vector ON comments USING GIN (search_vector)",
+]
+
+# The comment fields of a result; the search columns stay in the database
+RESULT_COLUMNS = ", ".join(
+    f"c.{column}" for column in
+    ("id", "project_id", "page_id", "x", "y", "text", "author", "resolved", "created_at", "updated_at", "revision")
+)
+
+SQLITE_SEARCH_SQL = f"""
+    SELECT {RESULT_COLUMNS}, p.title AS project_title,
+           snippet(comment_search, 0, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_WORDS}) AS snippet,
+           -bm25(comment_search, 1.0, 0.0) AS score
+    FROM comment_search
+    JOIN comments c ON c.search_rowid = comment_search.rowid
+    JOIN projects p ON p.id = c.project_id
+    -- Comments of a deleted page linger until its cleanup job has run
+    JOIN pages pg ON pg.id = c.page_id
+    WHERE comment_search MATCH :match
+    ORDER BY bm25(comment_search, 1.0, 0.0), c.id
+    LIMIT :limit OFFSET :offset
+"""
+
+POSTGRES_SEARCH_SQL = f"""
+    SELECT {RESULT_COLUMNS}, p.title AS project_title,
+           ts_headline('english', c.text, query, :headline_options) AS snippet,
+           ts_rank(c.search_vector, query) AS score
+    FROM comments c
+    JOIN projects p ON p.id = c.project_id
+    JOIN pages pg ON pg.id = c.page_id,
+         websearch_to_tsquery('english', :q) query
+    WHERE c.search_vector @@ query AND c.project_id IN :project_ids
+    ORDER BY score DESC, c.id
+    LIMIT :limit OFFSET :offset
+"""
+
+HEADLINE_OPTIONS = (
+    f"StartSel={MARK_START}, StopSel={MARK_END}, "
+    f"MaxWords={SNIPPET_WORDS * 2}, MinWords={SNIPPET_WORDS // 2}, MaxFragments=1"
+)
+
+
+async def install(conn: AsyncConnection):
+    for ddl in POSTGRES_DDL if conn.dialect.name == "postgresql" else SQLITE_DDL:
+        await conn.execute(text(ddl))
+
+
+def match_expression(q: str, project_ids: List[str]) -> Optional[str]:
+    """
+    FTS5 query: every word of `q` (the last one as a prefix, for
+    search-as-you-type), restricted to the given projects.
+    """
+    words = re.findall(r"\w+", q)
+    if not words or not project_ids:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    projects = " OR ".join(f'"{project_id.replace("-", "")}"' for project_id in project_ids)
+    return f"text : ({' '.join(terms)}) AND project_id : ({projects})"
+
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+async def search_comments(db: AsyncSession, q: str, project_ids: List[str], limit: int, offset: int) -> list:
+    """Ranked matching comments, best first, each with project_title, snippet and score."""
+    if not project_ids:
+        return []
+    params = {"limit": limit, "offset": offset}
+    if db.get_bind().dialect.name == "postgresql":
+        statement = text(POSTGRES_SEARCH_SQL).bindparams(bindparam("project_ids", expanding=True))
+        params.update(q=q, project_ids=project_ids, headline_options=HEADLINE_OPTIONS)
+    else:
+        match = match_expression(q, project_ids)
+        if match is None:
+            return []
+        statement = text(SQLITE_SEARCH_SQL)
+        params["match"] = match
+    result = await db.execute(statement, params)
+    return result.fetchall()
@@ -0,0 +1,52 @@
+import asyncio
+import os
+from typing import Dict
+
+# Longest a follower waits on a leader before fetching for itself
+PROXY_COALESCE_TIMEOUT = float(os.getenv("PROXY_COALESCE_TIMEOUT", "30"))
+
+
+class SingleFlight:
+    """
+    Tracks in-flight upstream fetches by key. The first caller for a key
+    becomes the leader and fetches; concurrent callers wait for it to finish
+    and then read the result from the cache it filled. A leader whose
+    response cannot be shared finishes early, so followers fetch their own.
+    """
+
+    def __init__(self, timeout: float = PROXY_COALESCE_TIMEOUT):
+        self._flights: Dict[str, asyncio.Event] = {}
+        self.timeout = timeout
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def start(self, key: str) -> bool:
+        """Register a fetch for key. Returns False if one is already running."""
+        if key in self._flights:
+            return False
+        self._flights[key] = asyncio.Event()
+        self.leaders += 1
+        return True
+
+    async def wait(self, key: str):
+        event = self._flights.get(key)
+        if event is not None:
+            self.followers += 1
+            try:
+                await asyncio.wait_for(event.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+
+    def finish(self, key: str):
+        event = self._flights.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timeouts": self.timeouts,
+        }
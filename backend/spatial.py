@@ -0,0 +1,131 @@
+"""
+In-memory spatial index for viewport queries on a page's annotations.
+
+Each page gets a uniform grid over its percentage coordinate space. Every
+annotation is filed under the cells its bounding box touches, so a
+viewport query only looks at the annotations near the visible area.
+
+Indexes are kept per worker in an LRU and tagged with the page revision
+they reflect; main.py brings a stale index up to date from the changes
+feed instead of rebuilding it.
+"""
+import math
+import os
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+Box = Tuple[float, float, float, float]  # min_x, min_y, max_x, max_y
+
+VIEWPORT_GRID_CELL = float(os.getenv("VIEWPORT_GRID_CELL", "2.5"))
+VIEWPORT_INDEX_MAX_PAGES = int(os.getenv("VIEWPORT_INDEX_MAX_PAGES", "256"))
+
+
+def intersects(a: Box, b: Box) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def segment_box(x1: float, y1: float, x2: float, y2: float) -> Box:
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+class GridIndex:
+    """Uniform grid of cells; each entry is a key with one or more (box, item) parts."""
+
+    def __init__(self, cell_size: float = VIEWPORT_GRID_CELL):
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Set[str]] = defaultdict(set)
+        self._entries: Dict[str, List[Tuple[Box, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cell_range(self, box: Box) -> Tuple[range, range]:
+        size = self.cell_size
+        return (range(math.floor(box[0] / size), math.floor(box[2] / size) + 1),
+                range(math.floor(box[1] / size), math.floor(box[3] / size) + 1))
+
+    def _cells_for(self, box: Box) -> Iterable[Tuple[int, int]]:
+        xs, ys = self._cell_range(box)
+        return ((cx, cy) for cx in xs for cy in ys)
+
+    def put(self, key: str, parts: List[Tuple[Box, Any]]):
+        self.remove(key)
+        self._entries[key] = parts
+        for box, _ in parts:
+            for cell in self._cells_for(box):
+                self._cells[cell].add(key)
+
+    def remove(self, key: str):
+        parts = self._entries.pop(key, None)
+        if parts is None:
+            return
+        for box, _ in parts:
+            for cell in self._cells_for(box):
+                keys = self._cells.get(cell)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if not keys:
+                    del self._cells[cell]
+
+    def query(self, box: Box) -> List[Any]:
+        """Items whose bounding box intersects `box`."""
+        if any(math.isinf(bound) for bound in box):
+            keys: Iterable[str] = self._entries
+        else:
+            xs, ys = self._cell_range(box)
+            if len(xs) * len(ys) >= len(self._cells):
+                # Viewport covers more cells than are occupied; walk the entries
+                keys = self._entries
+            else:
+                keys = set()
+                for cx in xs:
+                    for cy in ys:
+                        keys |= self._cells.get((cx, cy), set())
+        return [item for key in keys for part_box, item in self._entries[key] if intersects(part_box, box)]
+
+
+class PageAnnotations:
+    """Spatial indexes for one page as of `revision`."""
+
+    def __init__(self, revision: int):
+        self.revision = revision
+        self.comments = GridIndex()
+        self.lines = GridIndex()
+
+
+class ViewportCache:
+    """LRU of per-page indexes."""
+
+    def __init__(self, max_pages: int = VIEWPORT_INDEX_MAX_PAGES):
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[str, PageAnnotations]" = OrderedDict()
+        self.hits = 0
+        self.updates = 0
+        self.builds = 0
+
+    def get(self, page_id: str) -> Optional[PageAnnotations]:
+        page = self._pages.get(page_id)
+        if page is not None:
+            self._pages.move_to_end(page_id)
+        return page
+
+    def put(self, page_id: str, page: PageAnnotations):
+        self._pages[page_id] = page
+        self._pages.move_to_end(page_id)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def discard(self, page_id: str):
+        self._pages.pop(page_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "pages": len(self._pages),
+            "hits": self.hits,
+            "updates": self.updates,
+            "builds": self.builds,
+        }
+
+
+viewport_cache = ViewportCache()
@@ -0,0 +1,41 @@
+"""
+Query budget checks, run with pytest from the backend directory.
+
+These are the maintenance.py checks on a scratch SQLite database built by
+the migrations, so a regression fails the run instead of waiting for
+someone to run the command by hand.
+"""
+import asyncio
+
+from database import create_db_engine
+from maintenance import check_query_plans, listing_query_counts
+from migrations import run_migrations
+
+
+async def migrated_engine(path):
+    engine = create_db_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await run_migrations(conn)
+    return engine
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    async def full_scans():
+        engine = await migrated_engine(tmp_path / "plans.db")
+        async with engine.connect() as conn:
+            failures = await check_query_plans(conn)
+        await engine.dispose()
+        return failures
+
+    assert asyncio.run(full_scans()) == []
+
+
+def test_project_listing_query_count_is_constant(tmp_path):
+    async def counts():
+        engine = await migrated_engine(tmp_path / "counts.db")
+        per_listing = await listing_query_counts(engine, [1, 20])
+        await engine.dispose()
+        return per_listing
+
+    for listing, (one, many) in asyncio.run(counts()).items():
+        assert one == many, f"{listing} runs {one} statement(s) for 1 project but {many} for 20"